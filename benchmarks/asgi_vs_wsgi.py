@@ -0,0 +1,152 @@
+"""
+Compare the WSGI (DRF) and the native async (ASGI) API paths under concurrent load.
+
+The WSGI application is driven with one thread per in-flight request, the ASGI application with one
+coroutine per in-flight request on a single event loop, both in-process so no HTTP server is needed:
+
+    python -m benchmarks.asgi_vs_wsgi --modems 1000 --sms-per-modem 5 --concurrency 10 100 500 --output asgi.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from benchmarks.common import create_token, seed_fleet, summarize, temporary_database
+
+from django.db import connections  # noqa: E402
+
+from core.asgi import application as asgi_application  # noqa: E402
+from core.wsgi import application as wsgi_application  # noqa: E402
+
+# (name, WSGI path, ASGI path, query parameters)
+ENDPOINTS = [
+    ('list_modems', '/api/list_modems/', '/api/async/list_modems/', {'pagination': 'cursor', 'page_size': 50}),
+    ('sms_get', '/api/sms/get/', '/api/async/sms/get/', {'index': 1}),
+    ('fetch_sms_phone_number', '/api/sms/fetch_sms_phone_number/', '/api/async/sms/fetch_sms_phone_number/',
+     {'phone_number': '5550000000'}),
+    ('reboot_modem', '/api/reboot_modem/', '/api/async/reboot_modem/', {'index': 1}),
+]
+
+
+def wsgi_get(path, query, token):
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(PATH_INFO=path, QUERY_STRING=query, HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Token {token}')
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split()[0]))
+
+    started = time.perf_counter()
+    response = wsgi_application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0], time.perf_counter() - started
+
+
+async def asgi_get(path, query, token):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'authorization', f'Token {token}'.encode())],
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    started = time.perf_counter()
+    await asgi_application(scope, receive, send)
+    return messages[0]['status'], time.perf_counter() - started
+
+
+def run_wsgi(path, query, token, requests, concurrency):
+    def worker(_):
+        try:
+            return wsgi_get(path, query, token)
+        finally:
+            # Every thread owns its own database connection
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(requests)))
+    return results, time.perf_counter() - started
+
+
+def run_asgi(path, query, token, requests, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                return await asgi_get(path, query, token)
+
+        return await asyncio.gather(*(limited() for _ in range(requests)))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    return results, time.perf_counter() - started
+
+
+def report(results, elapsed):
+    return {
+        'errors': sum(1 for status, _ in results if status >= 400),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'latency': summarize([duration for _, duration in results]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modems', type=int, default=1000)
+    parser.add_argument('--sms-per-modem', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = {'modems': args.modems, 'sms_per_modem': args.sms_per_modem, 'endpoints': {}}
+    with temporary_database():
+        seed_fleet(args.modems, args.sms_per_modem)
+        token = create_token()
+
+        for name, wsgi_path, asgi_path, params in ENDPOINTS:
+            query = urlencode(params)
+            results['endpoints'][name] = {
+                concurrency: {
+                    'wsgi': report(*run_wsgi(wsgi_path, query, token, args.requests, concurrency)),
+                    'asgi': report(*run_asgi(asgi_path, query, token, args.requests, concurrency)),
+                }
+                for concurrency in args.concurrency
+            }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Shared helpers of the benchmark scripts: Django setup, a throwaway database, fleet seeding and statistics.
+
+Benchmarks never touch the development database; every run works on a temporary SQLite file that is
+destroyed afterwards.
+"""
+import os
+import random
+import statistics
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from modems.models import Modem  # noqa: E402
+from sms.models import SMS  # noqa: E402
+
+# Benchmarks run with production-like settings: no per-query logging, any host accepted
+settings.DEBUG = False
+settings.ALLOWED_HOSTS = ['*']
+
+# Modems sharing a phone number, so lookups by number return several modems
+MODEMS_PER_PHONE_NUMBER = 4
+
+
+@contextmanager
+def temporary_database():
+    """
+    Create a migrated SQLite database in a temporary directory for the duration of the block.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def phone_number_for(index):
+    return f'555{index // MODEMS_PER_PHONE_NUMBER:07d}'
+
+
+def seed_fleet(modems, sms_per_modem=0, batch_size=5000, seed=0):
+    """
+    Bulk insert `modems` modems and `sms_per_modem` messages for each of them.
+
+    Rows are generated deterministically from `seed` so runs are comparable between commits.
+    """
+    rng = random.Random(seed)
+    models = [choice for choice, _ in Modem.model_choices]
+    carriers = [choice for choice, _ in Modem.carrier_choices]
+
+    for start in range(0, modems, batch_size):
+        Modem.objects.bulk_create([
+            Modem(
+                model=rng.choice(models),
+                carrier=rng.choice(carriers),
+                public_ip='.'.join(str(rng.randint(1, 254)) for _ in range(4)),
+                ipv4='.'.join(str(rng.randint(1, 254)) for _ in range(4)),
+                ipv6=':'.join(f'{rng.randint(0, 65535):x}' for _ in range(8)),
+                phone_number=phone_number_for(index),
+            )
+            for index in range(start, min(start + batch_size, modems))
+        ])
+
+    if sms_per_modem:
+        modem_ids = list(Modem.objects.values_list('id', flat=True))
+        epoch = datetime(2023, 8, 1, tzinfo=dt_timezone.utc)
+        pending = []
+        for position in range(len(modem_ids) * sms_per_modem):
+            sent = epoch + timedelta(seconds=position)
+            pending.append(SMS(
+                modem_id=modem_ids[position % len(modem_ids)],
+                date=sent,
+                phone_number=f'555{rng.randint(0, 9999999):07d}',
+                content='Benchmark message',
+                timestamp=sent.timestamp(),
+            ))
+            if len(pending) == batch_size:
+                SMS.objects.bulk_create(pending)
+                pending = []
+        SMS.objects.bulk_create(pending)
+
+
+def create_token():
+    user = get_user_model().objects.create_user(username='benchmark', password='benchmark')
+    return Token.objects.create(user=user).key
+
+
+def summarize(samples):
+    """
+    Latency percentiles (in milliseconds) of a list of durations in seconds.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
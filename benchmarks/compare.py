@@ -0,0 +1,55 @@
+"""
+Compare two benchmark result files and report latency, query count and memory regressions.
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+
+Exits with status 1 when any endpoint regressed by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+# Metrics compared between runs: (label, function extracting the value from an endpoint result)
+METRICS = [
+    ('p50_ms', lambda result: result['latency'].get('p50_ms')),
+    ('p95_ms', lambda result: result['latency'].get('p95_ms')),
+    ('queries', lambda result: result['queries']),
+    ('peak_memory_kb', lambda result: result['peak_memory_kb']),
+]
+
+
+def compare(before, after, threshold):
+    rows = []
+    for name, result in after['endpoints'].items():
+        if name not in before['endpoints']:
+            continue
+        for metric, extract in METRICS:
+            old, new = extract(before['endpoints'][name]), extract(result)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            # Query counts must never grow; timings and memory get some noise tolerance
+            regressed = new > old if metric == 'queries' else change > threshold
+            rows.append((name, metric, old, new, change, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown tolerated (default 10%%)')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as before, open(args.after) as after:
+        rows = compare(json.load(before), json.load(after), args.threshold)
+
+    for name, metric, old, new, change, regressed in rows:
+        flag = 'REGRESSION' if regressed else ''
+        print(f'{name:<24} {metric:<15} {old:>12} {new:>12} {change:>+8.1%} {flag}')
+
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
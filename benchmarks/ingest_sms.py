@@ -0,0 +1,69 @@
+"""
+Measure the sustained throughput of the bulk SMS ingestion, records addressed by modem id and by phone number:
+
+    python -m benchmarks.ingest_sms --modems 1000 --messages 200000 --output ingest.json
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from benchmarks.common import seed_fleet, temporary_database
+
+from modems.models import Modem  # noqa: E402
+from sms.ingest import ingest_sms  # noqa: E402
+
+
+def generate_records(modem_ids, phone_numbers, messages):
+    epoch = datetime(2023, 8, 1, tzinfo=dt_timezone.utc)
+    for position in range(messages):
+        sent = epoch + timedelta(seconds=position)
+        record = {'date': sent.isoformat(), 'phone_number': '5551234567', 'content': 'Benchmark message'}
+        # Every other record names its modem by phone number
+        if position % 2 and phone_numbers:
+            record['modem_phone_number'] = phone_numbers[position % len(phone_numbers)]
+        else:
+            record['modem'] = modem_ids[position % len(modem_ids)]
+        yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modems', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--transaction-size', type=int)
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    with temporary_database():
+        seed_fleet(args.modems)
+        modem_ids = list(Modem.objects.values_list('id', flat=True))
+        phone_numbers = [f'9{modem_id:09d}' for modem_id in modem_ids[::2]]
+        for modem_id, phone_number in zip(modem_ids[::2], phone_numbers):
+            Modem.objects.filter(id=modem_id).update(phone_number=phone_number)
+
+        started = time.perf_counter()
+        result = ingest_sms(generate_records(modem_ids, phone_numbers, args.messages), args.batch_size,
+                            args.transaction_size)
+        elapsed = time.perf_counter() - started
+
+    results = {
+        'modems': args.modems,
+        'messages': args.messages,
+        'created': result['created'],
+        'rejected': result['rejected'],
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(result['created'] / elapsed, 1),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark every API endpoint against a seeded fleet and write the results as JSON.
+
+For each endpoint the suite measures latency percentiles over `--iterations` requests, then replays one
+request to record its query count and peak Python memory. Fleets are seeded deterministically so results
+of different commits can be compared with `python -m benchmarks.compare`:
+
+    python -m benchmarks.run --fleet small --output before.json
+    python -m benchmarks.run --modems 100000 --sms 1000000 --iterations 20 --output after.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone as dt_timezone
+
+from benchmarks.common import create_token, phone_number_for, seed_fleet, summarize, temporary_database
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+# Preset fleet sizes: (modems, SMS messages)
+FLEETS = {
+    'small': (1_000, 10_000),
+    'medium': (100_000, 1_000_000),
+    'large': (1_000_000, 10_000_000),
+}
+
+# (name, path, query parameters, whether the endpoint writes to the whole fleet)
+ENDPOINTS = [
+    ('list_modems', '/api/list_modems/', {}, False),
+    ('list_modems_cursor', '/api/list_modems/', {'pagination': 'cursor', 'page_size': 100, 'count': 'false'}, False),
+    ('list_modems_cursor_fast', '/api/list_modems/',
+     {'pagination': 'cursor', 'page_size': 1000, 'count': 'false', 'fast': 'true'}, False),
+    ('list_modems_cursor_1000', '/api/list_modems/', {'pagination': 'cursor', 'page_size': 1000, 'count': 'false'}, False),
+    ('rotate', '/api/rotate/', {}, True),
+    ('reboot_modem', '/api/reboot_modem/', {'index': 1}, False),
+    ('custom_rot', '/api/custom_rot/', {'index': 'all', 'min': 5}, True),
+    ('sms_get', '/api/sms/get/', {'index': 1}, False),
+    ('sms_get_all', '/api/sms/get/', {'page_size': 100, 'count': 'false'}, False),
+    ('sms_get_all_1000', '/api/sms/get/', {'page_size': 1000, 'count': 'false'}, False),
+    ('sms_get_all_fast', '/api/sms/get/', {'page_size': 1000, 'count': 'false', 'fast': 'true'}, False),
+    ('fetch_sms_phone_number', '/api/sms/fetch_sms_phone_number/', {'phone_number': phone_number_for(0)}, False),
+]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(client, path, params, iterations):
+    durations = []
+    status_codes = set()
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = client.get(path, params)
+        durations.append(time.perf_counter() - started)
+        status_codes.add(response.status_code)
+
+    # Replay one request to count its queries and trace its peak memory without skewing the latencies
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as context:
+        client.get(path, params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'status_codes': sorted(status_codes),
+        'latency': summarize(durations),
+        'queries': len(context.captured_queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', choices=FLEETS, default='small', help='Preset fleet size')
+    parser.add_argument('--modems', type=int, help='Number of modems (overrides --fleet)')
+    parser.add_argument('--sms', type=int, help='Total number of SMS messages (overrides --fleet)')
+    parser.add_argument('--iterations', type=int, default=50, help='Requests per read endpoint')
+    parser.add_argument('--write-iterations', type=int, default=5, help='Requests per fleet-wide write endpoint')
+    parser.add_argument('--only', nargs='+', choices=[name for name, *_ in ENDPOINTS], help='Endpoints to run')
+    parser.add_argument('--no-page-cache', action='store_true',
+                        help='Serialize every modem list page instead of serving it from the page cache')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.no_page_cache:
+        settings.CACHES[settings.MODEM_LIST_CACHE_ALIAS] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+    modems, sms = FLEETS[args.fleet]
+    modems = args.modems if args.modems is not None else modems
+    sms = args.sms if args.sms is not None else sms
+
+    results = {
+        'revision': git_revision(),
+        'created': datetime.now(dt_timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'modems': modems,
+        'sms': sms,
+        'page_cache': not args.no_page_cache,
+        'endpoints': {},
+    }
+
+    with temporary_database():
+        started = time.perf_counter()
+        seed_fleet(modems, sms_per_modem=sms // modems if modems else 0)
+        results['seed_seconds'] = round(time.perf_counter() - started, 3)
+
+        client = Client(HTTP_AUTHORIZATION=f'Token {create_token()}')
+        for name, path, params, fleet_wide in ENDPOINTS:
+            if args.only and name not in args.only:
+                continue
+            iterations = args.write_iterations if fleet_wide else args.iterations
+            results['endpoints'][name] = measure(client, path, params, iterations)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient
+
+import core.events
+from core.authentication import token_cache
+from core.events import InProcessBroker
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    # Cached tokens and their counters are process-local; start every test without them
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+
+class RecordingBroker(InProcessBroker):
+    """
+    Broker recording the published events instead of fanning them out.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def has_subscribers(self):
+        return True
+
+    def publish(self, events):
+        self.events.extend(events)
+
+
+@pytest.fixture
+def published_events(monkeypatch):
+    # Events published after each commit, recorded by a broker standing in for the process' one
+    broker = RecordingBroker()
+    monkeypatch.setattr(core.events, '_broker', broker)
+    return broker.events
+
+
+@pytest.fixture
+def async_get():
+    # Issue a GET request through the async request handler from a synchronous test
+    client = AsyncClient()
+
+    def get(path, data=None, **extra):
+        async def request():
+            return await client.get(path, data, **extra)
+        return async_to_sync(request)()
+
+    return get
@@ -3,6 +3,12 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+In production serve it with an ASGI server so the native async views under
+/api/async/ and the event stream (EVENT_STREAM_PATH) handle many concurrent
+connections without a thread per request:
+
+    uvicorn core.asgi:application --host 0.0.0.0 --port 8001 --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -13,4 +19,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from django.conf import settings  # noqa: E402
+from modems.async_views import EventStreamApplication  # noqa: E402
+
+# The event stream is served outside of Django's handler, which does not detect disconnected clients
+application = EventStreamApplication(django_application, settings.EVENT_STREAM_PATH)
@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver applying the SQLITE_PRAGMAS setting to every new SQLite connection.
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    # In-memory databases cannot use the WAL journal
+    if connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    transaction.atomic() holding the database write lock from its start on SQLite.
+
+    SQLite transactions start deferred: one that reads before it writes fails at once with "database is locked"
+    when another connection commits in between, instead of waiting for the busy timeout. An UPDATE matching no row
+    takes the write lock up front, like BEGIN IMMEDIATE, which Django 4.2 cannot issue. Other databases lock rows
+    and need nothing more.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    with transaction.atomic(using=using):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('UPDATE django_migrations SET id = id WHERE 0')
+        yield
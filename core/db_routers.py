@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Route every read of the block to the primary database, e.g. to read your own writes.
+    """
+    token = _pinned_to_primary.set(True)
+    try:
+        yield
+    finally:
+        _pinned_to_primary.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send the reads of the listing models to the DATABASE_REPLICA_ALIAS database when it is configured.
+
+    The fleet version is read from the replica too, so list ETags and cached pages always describe what the
+    replica returns. Writes, every other model (critical mode must apply at once) and reads made inside a
+    transaction on the primary, like the read-modify-write of a rotation, use the primary.
+    """
+
+    replica_models = {'modems.modem', 'modems.fleetversion', 'sms.sms'}
+
+    def db_for_read(self, model, **hints):
+        alias = settings.DATABASE_REPLICA_ALIAS
+        if alias not in settings.DATABASES or model._meta.label_lower not in self.replica_models:
+            return None
+        if _pinned_to_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives its schema through replication
+        return db == DEFAULT_DB_ALIAS
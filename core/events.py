@@ -0,0 +1,200 @@
+"""
+Modem rotation and SMS events, fanned out to the subscribers of the event stream.
+
+Write paths publish lists of events after their transaction commits. Every event is a dict with a 'type' and the
+'modem' id it concerns, which is what subscriptions filter on. Subscribers are asyncio queues registered by modem
+id, so an idle subscriber costs one suspended coroutine and publishing only touches the matching subscribers.
+
+The in-process broker only reaches subscribers of the publishing process; set EVENT_BROKER_URL to a Redis URL to
+relay events published anywhere (e.g. by Celery workers) to every ASGI process.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Queue of the events of a set of modems (every modem when `modem_ids` is None), read by one stream.
+    """
+
+    def __init__(self, broker, modem_ids, loop, max_size):
+        self.broker = broker
+        self.modem_ids = modem_ids
+        self.loop = loop
+        self.queue = asyncio.Queue(max_size)
+        self.dropped = 0
+
+    def deliver(self, event):
+        # Called from any thread; the queue is only touched from the subscriber's event loop
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        # A subscriber that does not keep up loses events instead of growing without bounds
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Fans events out to the subscriptions of this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_modem = defaultdict(set)
+        self.everything = set()
+
+    def has_subscribers(self):
+        return bool(self.by_modem or self.everything)
+
+    def subscribe(self, modem_ids=None):
+        """
+        Register a subscription on the running event loop for the events of `modem_ids`, or of every modem.
+        """
+        subscription = Subscription(self, modem_ids, asyncio.get_running_loop(), settings.EVENT_QUEUE_SIZE)
+        with self.lock:
+            if modem_ids is None:
+                self.everything.add(subscription)
+            for modem_id in modem_ids or ():
+                self.by_modem[modem_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.everything.discard(subscription)
+            for modem_id in subscription.modem_ids or ():
+                subscribers = self.by_modem.get(modem_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.by_modem[modem_id]
+
+    def publish(self, events):
+        self.dispatch(events)
+
+    def dispatch(self, events):
+        with self.lock:
+            if not self.has_subscribers():
+                return
+            targets = [
+                (event, list(self.everything) + list(self.by_modem.get(event['modem'], ())))
+                for event in events
+            ]
+        for event, subscribers in targets:
+            for subscription in subscribers:
+                subscription.deliver(event)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Relays events through a Redis pub/sub channel to the InProcessBroker of every process.
+
+    Each batch of events is one message; a listener thread, started with the first subscription, dispatches the
+    messages of the channel to the local subscribers and reconnects whenever the connection to Redis fails.
+    """
+    retry_delay = 0.5
+    max_retry_delay = 30
+
+    def __init__(self, url, channel):
+        super().__init__()
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.listener = None
+
+    def has_subscribers(self):
+        # Subscribers of other processes are unknown, so every event is published
+        return True
+
+    def subscribe(self, modem_ids=None):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='event-broker', daemon=True)
+                self.listener.start()
+        return super().subscribe(modem_ids)
+
+    def publish(self, events):
+        self.client.publish(self.channel, json.dumps(events))
+
+    def listen(self):
+        try:
+            self.relay()
+        finally:
+            # Let the next subscription start a new listener should this one ever stop
+            with self.lock:
+                self.listener = None
+
+    def relay(self):
+        # Reconnect with an exponential backoff when the connection to Redis fails; events published meanwhile
+        # are lost, like events published while no process listens
+        from redis import RedisError
+
+        delay = self.retry_delay
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                delay = self.retry_delay
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        super().dispatch(json.loads(message['data']))
+            except RedisError as exc:
+                logger.warning('Event broker connection failed (%s), reconnecting in %ss', exc, delay)
+            finally:
+                pubsub.close()
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def dispatch(self, events):
+        with self.lock:
+            if not (self.by_modem or self.everything):
+                return
+        super().dispatch(events)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            if settings.EVENT_BROKER_URL:
+                _broker = RedisBroker(settings.EVENT_BROKER_URL, settings.EVENT_CHANNEL)
+            else:
+                _broker = InProcessBroker()
+        return _broker
+
+
+def wants_events():
+    """
+    Whether publishing is worth building events for, to skip them when nobody can receive them.
+    """
+    return get_broker().has_subscribers()
+
+
+def publish_on_commit(events):
+    """
+    Publish a list of events once the current transaction commits (immediately outside a transaction).
+    """
+    if events:
+        transaction.on_commit(partial(get_broker().publish, events))
@@ -87,27 +87,141 @@ WSGI_APPLICATION = 'core.wsgi.application'
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_BROKER_URL','django-db')
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    # A single scanner rotates every modem whose RotationSchedule is due
+    'rotate-due-modems': {
+        'task': 'modems.tasks.rotate_due_modems',
+        'schedule': float(os.getenv('ROTATION_SCAN_INTERVAL', 30)),
+    },
+    # Enforces the SMS retention policy
+    'prune-sms': {
+        'task': 'sms.tasks.prune_sms',
+        'schedule': float(os.getenv('SMS_PRUNE_INTERVAL', 3600)),
+    },
+}
+
+# Number of due modems rotated per scanner transaction
+ROTATION_SCAN_BATCH_SIZE = int(os.getenv('ROTATION_SCAN_BATCH_SIZE', 1000))
+# Modems rotated per transaction by the fleet rotation
+ROTATION_CHUNK_SIZE = int(os.getenv('ROTATION_CHUNK_SIZE', 1000))
+# Rotations per scanner run, 0 for no limit; modems past the limit stay due and are rotated by the next run
+ROTATION_SCAN_MAX_ROTATIONS = int(os.getenv('ROTATION_SCAN_MAX_ROTATIONS', 0))
+
+# SMS retention policy; 0 keeps messages regardless of their age or of the number of messages per modem
+SMS_RETENTION_MAX_AGE_DAYS = int(os.getenv('SMS_RETENTION_MAX_AGE_DAYS', 0))
+SMS_RETENTION_MAX_PER_MODEM = int(os.getenv('SMS_RETENTION_MAX_PER_MODEM', 0))
+
+# Messages deleted per pruning transaction and seconds to pause between two of them
+SMS_PRUNE_CHUNK_SIZE = int(os.getenv('SMS_PRUNE_CHUNK_SIZE', 1000))
+SMS_PRUNE_PAUSE = float(os.getenv('SMS_PRUNE_PAUSE', 0.05))
 
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ]
 }
 
+# Tokens kept by each worker process's authentication cache and the seconds a cached token stays valid
+TOKEN_AUTH_CACHE_SIZE = int(os.getenv('TOKEN_AUTH_CACHE_SIZE', 10000))
+TOKEN_AUTH_CACHE_TTL = int(os.getenv('TOKEN_AUTH_CACHE_TTL', 60))
+
+# Seconds a process may serve its cached FeatureSettings without checking its version (requests check it once each)
+FEATURE_SETTINGS_CACHE_TTL = int(os.getenv('FEATURE_SETTINGS_CACHE_TTL', 5))
+
+# Rows per bulk INSERT and records per transaction of the bulk SMS ingestion
+SMS_INGEST_BATCH_SIZE = int(os.getenv('SMS_INGEST_BATCH_SIZE', 1000))
+SMS_INGEST_TRANSACTION_SIZE = int(os.getenv('SMS_INGEST_TRANSACTION_SIZE', 20000))
+
+# Critical mode masks per Modem field; fields without an entry are masked with CRITICAL_MODE_DEFAULT_MASK
+CRITICAL_MODE_DEFAULT_MASK = '********'
+CRITICAL_MODE_MASKS = {
+    'public_ip': '***.***.***.***',
+    'ipv4': '***.***.***.***',
+    'ipv6': '****:****:****:****:****:****:****:****',
+}
+
+# Event stream, served by the ASGI application only
+EVENT_STREAM_PATH = '/api/async/events/'
+# Events reach the subscribers of the publishing process only, unless EVENT_BROKER_URL points to a Redis server
+# relaying them between every process (required for the events published by Celery workers)
+EVENT_BROKER_URL = os.getenv('EVENT_BROKER_URL')
+EVENT_CHANNEL = os.getenv('EVENT_CHANNEL', 'modem-events')
+# Events queued per subscriber before newer ones are dropped, and seconds between stream keepalives
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', 1000))
+EVENT_STREAM_KEEPALIVE = float(os.getenv('EVENT_STREAM_KEEPALIVE', 15))
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Set CACHE_REDIS_URL to share the modem list page cache between every worker process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'modem_list': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'modem-list',
+        'TIMEOUT': 300,
+    },
+}
+
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES['modem_list'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL'),
+        'TIMEOUT': 300,
+    }
+
+# Cache alias storing serialized modem list pages
+MODEM_LIST_CACHE_ALIAS = 'modem_list'
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# DATABASE_PROFILE 'tuned' (default) keeps connections open and runs SQLite in WAL mode so reads never wait for
+# rotations; 'plain' uses the SQLite defaults. The test database is a file so concurrent connections behave the same.
+# Serve ASGI with DATABASE_CONN_MAX_AGE=0: persistent connections are per thread and not reused there.
+
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'tuned')
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# PRAGMAs applied to every new SQLite connection by core.db.apply_sqlite_pragmas
+SQLITE_PRAGMAS = {}
+
+if DATABASE_PROFILE == 'tuned':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        # Seconds to wait for a lock before failing with "database is locked"
+        'OPTIONS': {'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 20))},
+    })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    }
+
+# Optional read replica of the primary (e.g. a LiteFS or Litestream copy) serving the modem and SMS listings
+DATABASE_REPLICA_ALIAS = 'replica'
+
+if os.getenv('DATABASE_REPLICA_NAME'):
+    DATABASES[DATABASE_REPLICA_ALIAS] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DATABASE_REPLICA_NAME'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db_routers.PrimaryReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
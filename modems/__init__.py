@@ -1,6 +1,132 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination that seeks past the last row of the previous page.
+
+    Rows are ordered by the `ordering` fields (which must end with a unique field) and every page is fetched
+    with a `WHERE (ordering) > (cursor)` range condition, so deep pages cost the same as the first one.
+    The total count is included unless the client passes `count=false`.
+    """
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.prepare(request)
+        self.count = queryset.count() if self.include_count else None
+        return self.finish(list(self.get_page_queryset(queryset)))
+
+    async def apaginate_queryset(self, queryset, request):
+        # Same as paginate_queryset() for async views, using the async ORM API
+        self.prepare(request)
+        self.count = await queryset.acount() if self.include_count else None
+        return self.finish([row async for row in self.get_page_queryset(queryset)])
+
+    def prepare(self, request):
+        # request.GET works for both DRF requests and plain Django requests
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.include_count = request.GET.get(self.count_query_param, 'true').lower() not in ('0', 'false', 'no')
+        self.position = self.decode_cursor(request)
+
+    def get_page_queryset(self, queryset):
+        queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(self.get_seek_filter(self.position))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        # Fetch one extra row to know whether there is a next page without counting
+        return queryset[:self.page_size + 1]
+
+    def finish(self, rows):
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = self.get_position(rows[-1]) if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_seek_filter(self, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            equal = {name: value for name, value in zip(self.ordering[:index], position)}
+            conditions.append(Q(**equal, **{f'{field}__gt': position[index]}))
+        seek = reduce(lambda left, right: left | right, conditions)
+        if len(self.ordering) > 1:
+            # The database can't use the OR as an index range, so also bound the leading field: a >= x
+            seek &= Q(**{f'{self.ordering[0]}__gte': position[0]})
+        return seek
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return [row[field] for field in self.ordering]
+        return [getattr(row, field) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_first_link(self):
+        url = self.request.build_absolute_uri()
+        return remove_query_param(url, self.cursor_query_param)
+
+    def get_paginated_data(self, data):
+        response_data = {}
+        if self.include_count:
+            response_data['count'] = self.count
+        response_data['next'] = self.get_next_link()
+        response_data['first'] = self.get_first_link()
+        response_data['results'] = data
+        return response_data
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class ModemKeysetPagination(KeysetPagination):
+    ordering = ('id',)
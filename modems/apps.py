@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class ModemsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'modems'
+
+    def ready(self):
+        from core.db import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='apply_sqlite_pragmas')
+        from modems.models import recheck_feature_settings
+        request_started.connect(recheck_feature_settings, dispatch_uid='recheck_feature_settings')
+        # Connect the token cache invalidation receivers
+        import core.authentication  # noqa: F401
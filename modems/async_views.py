@@ -0,0 +1,275 @@
+import asyncio
+import io
+import json
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import JsonResponse
+from rest_framework.authtoken.models import Token
+
+from core.authentication import token_cache
+from core.events import get_broker
+from modems import ModemKeysetPagination
+from .models import ADDRESS_FIELDS, Modem, FeatureSettings
+from .serializers import MODEM_FIELDS, critical_mode_template, mask_modem
+
+
+async def authenticate_token(request):
+    """
+    Resolve the user of an 'Authorization: Token <key>' header with the async ORM.
+
+    Returns a (user, error message) tuple; the messages match the ones of DRF's TokenAuthentication. Tokens are
+    shared with the token cache of CachedTokenAuthentication.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0].lower() != 'token':
+        return None, 'Authentication credentials were not provided.'
+    if len(header) != 2:
+        return None, 'Invalid token header.'
+
+    token = token_cache.get(header[1])
+    if token is not None:
+        return token.user, None
+
+    try:
+        token = await Token.objects.select_related('user').aget(key=header[1])
+    except Token.DoesNotExist:
+        return None, 'Invalid token.'
+    if not token.user.is_active:
+        return None, 'User inactive or deleted.'
+    token_cache.set(token)
+    return token.user, None
+
+
+def token_required(view):
+    """
+    Decorator for async views that require token authentication, like the DRF views' IsAuthenticated default.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user, error = await authenticate_token(request)
+        if user is None:
+            response = JsonResponse({'detail': error}, status=401)
+            response['WWW-Authenticate'] = 'Token'
+            return response
+        request.user = user
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@token_required
+async def list_modems(request):
+    """
+    Async variant of ModemListView.
+
+    Modems are keyset paginated on their id ('cursor', 'page_size' and 'count' query parameters) and masked when
+    critical mode is enabled, in which case only the ids are read.
+    """
+    feature_settings = await sync_to_async(FeatureSettings.load)()
+    paginator = ModemKeysetPagination()
+
+    if feature_settings.critical_mode_enabled:
+        template = critical_mode_template()
+        rows = await paginator.apaginate_queryset(Modem.objects.values('id'), request)
+        rows = [mask_modem(row['id'], template) for row in rows]
+    else:
+        rows = await paginator.apaginate_queryset(Modem.objects.values(*MODEM_FIELDS), request)
+
+    return JsonResponse(paginator.get_paginated_data(rows))
+
+
+@token_required
+async def reboot_modem(request):
+    """
+    Async variant of RotateSpecificModemView.
+    """
+    # Get the 'index' query parameter from the request
+    modem_index = request.GET.get('index')
+
+    try:
+        modem = await Modem.objects.aget(pk=modem_index)
+    except (Modem.DoesNotExist, ValueError):
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    # Reboot through the model so every side effect of reboot_modem() is kept
+    await sync_to_async(modem.reboot_modem)()
+
+    return JsonResponse({"message": f"Modem {modem_index} rotated successfully."})
+
+
+def format_event(event, name=None):
+    # One server-sent event: its type as the event name and the JSON payload as data
+    return f'event: {name or event["type"]}\ndata: {json.dumps(event, separators=(",", ":"))}\n\n'
+
+
+class CriticalModeFlag:
+    """
+    Critical mode flag shared by the event streams of the process, re-read every FEATURE_SETTINGS_CACHE_TTL seconds.
+
+    Streams mask every event they send, so the flag is read once per process and period instead of through a
+    thread hop per event; a toggle reaches the open streams within the TTL.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.enabled = None
+        self.expires = 0.0
+
+    async def get(self):
+        now = time.monotonic()
+        if self.enabled is not None:
+            if now < self.expires:
+                return self.enabled
+            # Other streams keep using the current value while this one refreshes it
+            self.expires = now + settings.FEATURE_SETTINGS_CACHE_TTL
+        try:
+            feature_settings = await sync_to_async(FeatureSettings.load)()
+        except Exception:
+            self.expires = 0.0
+            raise
+        self.enabled = feature_settings.critical_mode_enabled
+        self.expires = time.monotonic() + settings.FEATURE_SETTINGS_CACHE_TTL
+        return self.enabled
+
+
+critical_mode = CriticalModeFlag()
+
+
+def mask_event(event, critical):
+    # Rotation events carry addresses, which are masked like the modem listing while critical mode is enabled
+    if not critical or event['type'] != 'modem.rotated':
+        return event
+    template = critical_mode_template()
+    return {**event, **{field: template[field] for field in ADDRESS_FIELDS}}
+
+
+async def open_event_stream(request):
+    """
+    Authenticate an event stream request and subscribe to the events it asks for.
+
+    Repeat the 'modem' (modem id) and 'phone_number' query parameters to receive only the events of those modems;
+    phone numbers are resolved to modem ids when the stream opens. Without filters every event is streamed.
+    Returns a (subscription, error response) tuple.
+    """
+    user, error = await authenticate_token(request)
+    if user is None:
+        response = JsonResponse({'detail': error}, status=401)
+        response['WWW-Authenticate'] = 'Token'
+        return None, response
+
+    modem_ids = request.GET.getlist('modem')
+    phone_numbers = request.GET.getlist('phone_number')
+    if not all(modem_id.isdigit() for modem_id in modem_ids):
+        return None, JsonResponse({'detail': "'modem' must be a modem id."}, status=400)
+
+    # Resolve the filters to the set of modem ids to subscribe to
+    subscribed = None
+    if modem_ids or phone_numbers:
+        subscribed = set(map(int, modem_ids))
+        if phone_numbers:
+            subscribed.update([
+                pk async for pk in Modem.objects.filter(phone_number__in=phone_numbers).values_list('id', flat=True)
+            ])
+
+    return get_broker().subscribe(subscribed), None
+
+
+async def stream_events(subscription):
+    # Server-sent events of a subscription, with a comment every EVENT_STREAM_KEEPALIVE seconds so proxies keep idle
+    # streams open, and an 'overflow' event reporting the events dropped while the client was not keeping up
+    yield ': connected\n\n'
+    dropped = 0
+    while True:
+        try:
+            event = await asyncio.wait_for(subscription.get(), settings.EVENT_STREAM_KEEPALIVE)
+        except asyncio.TimeoutError:
+            yield ': keepalive\n\n'
+            continue
+        if subscription.dropped != dropped:
+            yield format_event({'dropped': subscription.dropped - dropped}, name='overflow')
+            dropped = subscription.dropped
+        yield format_event(mask_event(event, await critical_mode.get()))
+
+
+class EventStreamApplication:
+    """
+    ASGI application streaming modem rotation and SMS events ('text/event-stream') at `path`.
+
+    Every other request goes to `application`. Django 4.2's ASGIHandler does not listen for http.disconnect while
+    it streams a response, so a stream served by a view would outlive its client along with its subscription.
+    The stream is therefore served on the raw ASGI connection, and it is closed with its subscription as soon as
+    the client disconnects.
+    """
+
+    def __init__(self, application, path):
+        self.application = application
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path:
+            return await self.application(scope, receive, send)
+
+        request = ASGIRequest(scope, io.BytesIO())
+        try:
+            subscription, error = await open_event_stream(request)
+        finally:
+            # Outside of Django's request cycle, so release the connection used to authenticate and resolve filters
+            await sync_to_async(close_old_connections)()
+        if error is not None:
+            await send_response(send, error.status_code, error.items(), error.content)
+            return
+
+        chunks = stream_events(subscription)
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers([
+                ('Content-Type', 'text/event-stream'),
+                ('Cache-Control', 'no-cache'),
+                # Keep reverse proxies from buffering the stream
+                ('X-Accel-Buffering', 'no'),
+            ])})
+            await until_disconnected(receive, self.pump(chunks, send))
+        finally:
+            await chunks.aclose()
+            subscription.close()
+            await sync_to_async(close_old_connections)()
+
+    @staticmethod
+    async def pump(chunks, send):
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+
+def encode_headers(headers):
+    # ASGI header names are lowercase byte strings
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def send_response(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def until_disconnected(receive, coroutine):
+    """
+    Run `coroutine` until it returns or the client disconnects, whichever comes first.
+    """
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(coroutine), asyncio.ensure_future(disconnected())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
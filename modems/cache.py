@@ -0,0 +1,62 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ModemListCache:
+    """
+    Server-side cache of serialized ModemListView pages.
+
+    Keys embed the fleet version and the critical mode flag, so a rotation, a reboot or a critical mode toggle
+    makes every cached page unreachable in all processes at once, and masked and unmasked pages never share an
+    entry. Unreachable entries age out after the cache TIMEOUT. The backend is the MODEM_LIST_CACHE_ALIAS cache,
+    local memory by default or any shared cache (e.g. Redis) configured in CACHES.
+    """
+
+    key_prefix = 'modem-list'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[settings.MODEM_LIST_CACHE_ALIAS]
+
+    def make_key(self, request, fleet_version, critical_mode):
+        # Pagination links are absolute URLs, so the host and path are part of the key along with every query
+        # parameter; views sharing the listing code (e.g. the search) never share entries
+        params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+        digest = hashlib.sha1(repr((request.build_absolute_uri(request.path), params)).encode()).hexdigest()
+        return f'{self.key_prefix}:{fleet_version}:{int(critical_mode)}:{digest}'
+
+    def get(self, key):
+        data = self.backend.get(key)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key, data):
+        self.backend.set(key, data)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = 0
+
+
+modem_list_cache = ModemListCache()
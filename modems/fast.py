@@ -0,0 +1,64 @@
+"""
+Opt-in fast serialization path for high-volume list endpoints.
+
+Instead of building a ModelSerializer for every row, rows are read with QuerySet.values() and converted through a
+field map compiled once from the serializer class. The output is the same as the serializer's, so responses stay
+byte-identical.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import serializers
+
+# Serializer fields whose representation of a values() row is the value itself
+PASSTHROUGH_FIELDS = (
+    serializers.IntegerField,
+    serializers.FloatField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.BooleanField,
+)
+
+FAST_QUERY_PARAM = 'fast'
+
+
+def format_datetime(value):
+    # Same ISO 8601 output as DRF's DateTimeField (UTC offsets are rendered as 'Z')
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def fast_path_requested(request):
+    return request.query_params.get(FAST_QUERY_PARAM, '').lower() in ('1', 'true')
+
+
+class ValuesSerializer:
+    """
+    Serialize values() rows with the field map of a ModelSerializer class.
+
+    Only plain model fields are supported; any other field raises ImproperlyConfigured when the map is compiled.
+    """
+
+    def __init__(self, serializer_class):
+        self.fields = []
+        self.converters = []
+        for name, field in serializer_class().fields.items():
+            if field.source != name:
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} is not a plain model field.')
+            if isinstance(field, serializers.DateTimeField):
+                self.converters.append((name, format_datetime))
+            elif not isinstance(field, PASSTHROUGH_FIELDS):
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} has no fast representation.')
+            self.fields.append(name)
+
+    def serialize(self, rows):
+        # Rows are converted in place; values() already returns them in the serializer's field order
+        converters = self.converters
+        for row in rows:
+            for name, convert in converters:
+                if row[name] is not None:
+                    row[name] = convert(row[name])
+        return rows
@@ -0,0 +1,28 @@
+from django.db import models
+
+from .ip import pack_address
+
+
+class PackedIPAddressField(models.BinaryField):
+    """
+    Indexed 16-byte packed form of the address held by the `source` field of the same model.
+
+    The value is derived from the source in pre_save(), so save(), create() and bulk_create() keep it in sync;
+    writes that bypass the ORM, like bulk_update_by_pk(), have to write it themselves.
+    """
+
+    def __init__(self, *args, source=None, **kwargs):
+        self.source = source
+        kwargs['max_length'] = 16
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        del kwargs['max_length']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = pack_address(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,125 @@
+"""
+Batched IP address generation for simulated modem reboots.
+
+Addresses are cut from one block of random bytes per batch and formatted with socket.inet_ntop(), instead of
+one random call per octet/segment. IPv6 addresses come out in the same canonical (RFC 5952) form Django stores.
+"""
+import ipaddress
+import random
+import socket
+
+# IPv4 first octets that are never globally routable: "this network", private, loopback, multicast and reserved
+RESERVED_IPV4_FIRST_OCTETS = frozenset([0, 10, 127, *range(224, 256)])
+
+# Reserved IPv4 prefixes below a routable first octet, as (first octet, second octet range, third octet or None)
+RESERVED_IPV4_PREFIXES = {
+    100: [(range(64, 128), None)],                  # 100.64.0.0/10 shared address space
+    169: [(range(254, 255), None)],                 # 169.254.0.0/16 link local
+    172: [(range(16, 32), None)],                   # 172.16.0.0/12 private
+    192: [(range(168, 169), None),                  # 192.168.0.0/16 private
+          (range(0, 1), 0), (range(0, 1), 2),       # 192.0.0.0/24 IETF, 192.0.2.0/24 documentation
+          (range(88, 89), 99)],                     # 192.88.99.0/24 6to4 relay
+    198: [(range(18, 20), None),                    # 198.18.0.0/15 benchmarking
+          (range(51, 52), 100)],                    # 198.51.100.0/24 documentation
+    203: [(range(0, 1), 113)],                      # 203.0.113.0/24 documentation
+}
+
+# Maps any byte to the first byte of a global unicast IPv6 address (2000::/3)
+GLOBAL_UNICAST_FIRST_BYTE = bytes(0x20 | (byte & 0x1f) for byte in range(256))
+
+
+def _is_reserved_ipv4(chunk):
+    if 0 in chunk or chunk[0] in RESERVED_IPV4_FIRST_OCTETS:
+        return True
+    for second_octets, third_octet in RESERVED_IPV4_PREFIXES.get(chunk[0], ()):
+        if chunk[1] in second_octets and (third_octet is None or chunk[2] == third_octet):
+            return True
+    return False
+
+
+def _is_reserved_ipv6(chunk):
+    # 2001::/23 IETF protocol assignments (Teredo, ...), 2001:db8::/32 documentation, 2002::/16 6to4
+    if chunk[0] != 0x20:
+        return False
+    return (chunk[1] == 0x01 and (chunk[2] < 0x02 or chunk[2:4] == b'\x0d\xb8')) or chunk[1] == 0x02
+
+
+def _generate(count, size, family, rng, normalize=None, is_reserved=None):
+    randbytes = rng.randbytes if rng is not None else random.randbytes
+    seen = set()
+    addresses = []
+    while len(addresses) < count:
+        # Draw the missing addresses at once; rejected or duplicate ones are drawn again on the next pass
+        missing = count - len(addresses)
+        block = randbytes(missing * size)
+        if normalize is not None:
+            block = normalize(block)
+        for offset in range(0, len(block), size):
+            chunk = block[offset:offset + size]
+            if chunk in seen or is_reserved(chunk):
+                continue
+            seen.add(chunk)
+            addresses.append(socket.inet_ntop(family, chunk))
+    return addresses
+
+
+def _global_unicast(block):
+    block = bytearray(block)
+    block[0::16] = bytes(block[0::16]).translate(GLOBAL_UNICAST_FIRST_BYTE)
+    return bytes(block)
+
+
+def generate_ipv4_batch(count, rng=None):
+    """
+    Return `count` distinct, globally routable IPv4 addresses without any zero octet.
+
+    Pass a seeded `random.Random` as `rng` for reproducible batches.
+    """
+    return _generate(count, 4, socket.AF_INET, rng, is_reserved=_is_reserved_ipv4)
+
+
+def generate_ipv6_batch(count, rng=None):
+    """
+    Return `count` distinct global unicast (2000::/3) IPv6 addresses outside the reserved and documentation ranges.
+
+    Pass a seeded `random.Random` as `rng` for reproducible batches.
+    """
+    return _generate(count, 16, socket.AF_INET6, rng, normalize=_global_unicast, is_reserved=_is_reserved_ipv6)
+
+
+def generate_address_batch(count, rng=None):
+    """
+    Return `count` (public_ip, ipv4, ipv6) triples; no address appears twice in the batch.
+    """
+    ipv4_addresses = generate_ipv4_batch(count * 2, rng)
+    return list(zip(ipv4_addresses[:count], ipv4_addresses[count:], generate_ipv6_batch(count, rng)))
+
+
+# Prefix of IPv4 addresses mapped into the IPv6 space (::ffff:0:0/96), so every address packs to 16 bytes
+IPV4_MAPPED_PREFIX = bytes(10) + b'\xff\xff'
+
+
+def pack_address(address):
+    """
+    Return the 16-byte big-endian form of an IPv4 or IPv6 address; IPv4 addresses are mapped into ::ffff:0:0/96.
+
+    Packed addresses compare bytewise in address order, so a CIDR block is a contiguous range of them.
+    Raises ValueError for an invalid address.
+    """
+    try:
+        if ':' in address:
+            return socket.inet_pton(socket.AF_INET6, address)
+        return IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, address)
+    except OSError:
+        raise ValueError(f'{address!r} is not a valid IP address.')
+
+
+def packed_range(cidr):
+    """
+    Return the first and last packed addresses of a CIDR block such as '10.20.0.0/16'; host bits are ignored.
+
+    Raises ValueError for an invalid block.
+    """
+    network = ipaddress.ip_network(cidr, strict=False)
+    prefix = IPV4_MAPPED_PREFIX if network.version == 4 else b''
+    return prefix + network.network_address.packed, prefix + network.broadcast_address.packed
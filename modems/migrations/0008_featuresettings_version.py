@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0007_alter_modem_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='featuresettings',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
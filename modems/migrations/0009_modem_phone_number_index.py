@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0008_featuresettings_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='modem',
+            name='phone_number',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+    ]
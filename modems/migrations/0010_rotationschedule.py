@@ -0,0 +1,51 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:12
+
+import json
+from datetime import timedelta
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def migrate_periodic_tasks(apps, schema_editor):
+    # Move the per-modem 'Rotating IP for Modem <pk>' beat entries over to rotation schedules
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    Modem = apps.get_model('modems', 'Modem')
+    RotationSchedule = apps.get_model('modems', 'RotationSchedule')
+
+    tasks = PeriodicTask.objects.filter(task='modems.tasks.rotate_ip', interval__isnull=False).select_related('interval')
+    existing = set(Modem.objects.values_list('id', flat=True))
+    now = timezone.now()
+    schedules = []
+    for task in tasks:
+        args = json.loads(task.args or '[]')
+        modem_id = args[0] if args else None
+        if modem_id not in existing or task.interval.period != 'minutes':
+            continue
+        interval = timedelta(minutes=task.interval.every)
+        schedules.append(RotationSchedule(modem_id=modem_id, interval=interval, next_due=now + interval))
+
+    RotationSchedule.objects.bulk_create(schedules, ignore_conflicts=True)
+    tasks.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+        ('modems', '0009_modem_phone_number_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RotationSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.DurationField()),
+                ('next_due', models.DateTimeField(db_index=True)),
+                ('modem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rotation_schedule', to='modems.modem')),
+            ],
+        ),
+        migrations.RunPython(migrate_periodic_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+def create_fleet_version(apps, schema_editor):
+    # Create the singleton row up front so bumps are always a single UPDATE
+    FleetVersion = apps.get_model('modems', 'FleetVersion')
+    FleetVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0010_rotationschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_fleet_version, migrations.RunPython.noop),
+    ]
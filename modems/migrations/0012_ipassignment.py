@@ -0,0 +1,47 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+ADDRESS_FIELDS = ('public_ip', 'ipv4', 'ipv6')
+
+
+def record_current_addresses(apps, schema_editor):
+    # Start the history with the addresses modems hold today
+    Modem = apps.get_model('modems', 'Modem')
+    IPAssignment = apps.get_model('modems', 'IPAssignment')
+    now = timezone.now()
+    history = []
+    for modem_id, *addresses in Modem.objects.values_list('id', *ADDRESS_FIELDS).iterator(chunk_size=2000):
+        history.extend(
+            IPAssignment(modem_id=modem_id, kind=kind, ip=ip, assigned_at=now) for kind, ip in enumerate(addresses)
+        )
+        if len(history) >= 6000:
+            IPAssignment.objects.bulk_create(history)
+            history = []
+    IPAssignment.objects.bulk_create(history)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0011_fleetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IPAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'public_ip'), (1, 'ipv4'), (2, 'ipv6')])),
+                ('ip', models.GenericIPAddressField()),
+                ('assigned_at', models.DateTimeField()),
+                ('modem', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ip_assignments', to='modems.modem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ip', 'assigned_at'], name='ipassignment_ip_time_idx'), models.Index(fields=['modem', 'kind', 'assigned_at'], name='ipassignment_modem_kind_idx')],
+            },
+        ),
+        migrations.RunPython(record_current_addresses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:41
+
+from django.db import migrations
+
+import modems.fields
+from modems.ip import pack_address
+
+ADDRESS_FIELDS = ('public_ip', 'ipv4', 'ipv6')
+
+
+def pack_addresses(apps, schema_editor):
+    # Fill the packed columns of the existing modems in chunks, with one prepared UPDATE per chunk
+    Modem = apps.get_model('modems', 'Modem')
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(Modem._meta.db_table),
+        ', '.join(f'{qn(field + "_packed")} = %s' for field in ADDRESS_FIELDS),
+        qn('id'),
+    )
+    last_pk = 0
+    with connection.cursor() as cursor:
+        while True:
+            rows = list(
+                Modem.objects.filter(id__gt=last_pk).order_by('id').values_list('id', *ADDRESS_FIELDS)[:5000]
+            )
+            if not rows:
+                break
+            cursor.executemany(sql, [[*map(pack_address, addresses), pk] for pk, *addresses in rows])
+            last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0012_ipassignment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modem',
+            name='public_ip_packed',
+            field=modems.fields.PackedIPAddressField(db_index=True, default=b'', source='public_ip'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='modem',
+            name='ipv4_packed',
+            field=modems.fields.PackedIPAddressField(db_index=True, default=b'', source='ipv4'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='modem',
+            name='ipv6_packed',
+            field=modems.fields.PackedIPAddressField(db_index=True, default=b'', source='ipv6'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(pack_addresses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0013_modem_packed_addresses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRotation',
+            fields=[
+                ('modem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_rotation', serialize=False, to='modems.modem')),
+                ('requested_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
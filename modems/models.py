@@ -1,6 +1,90 @@
-from random import shuffle
 import random
-from django.db import models, transaction
+import time
+from random import randint, shuffle
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from core.db import write_transaction
+from core.events import publish_on_commit, wants_events
+from .fields import PackedIPAddressField
+from .ip import generate_address_batch, generate_ipv4_batch, generate_ipv6_batch, pack_address
+
+
+def bulk_update_by_pk(model, fields, rows, prepare=True):
+    """
+    Write (pk, *values) rows for the given fields with one prepared UPDATE executed in bulk.
+
+    bulk_update() builds a CASE expression per row which is orders of magnitude slower on large
+    batches. Values are converted with each field's get_db_prep_save() unless `prepare` is False,
+    which callers use for values they read straight from the database.
+    """
+    qn = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(model._meta.db_table),
+        ', '.join(f'{qn(field.column)} = %s' for field in model_fields),
+        qn(model._meta.pk.column),
+    )
+    if prepare:
+        params = [
+            [field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row[1:])] + [row[0]]
+            for row in rows
+        ]
+    else:
+        params = [[*row[1:], row[0]] for row in rows]
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+    return len(params)
+
+
+def bulk_insert(model, fields, rows, prepare=True):
+    """
+    Insert rows of values for the given fields with one prepared INSERT executed in bulk.
+
+    bulk_create() compiles a multi-row INSERT per batch, capped at 999 parameters on SQLite, and prepares every value
+    through its field, which bounds large imports well below what the database sustains. Values are converted like
+    in bulk_update_by_pk(); pass `prepare=False` for values already in their database format.
+    """
+    qn = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        qn(model._meta.db_table),
+        ', '.join(qn(field.column) for field in model_fields),
+        ', '.join(['%s'] * len(model_fields)),
+    )
+    if prepare:
+        params = [[field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row)] for row in rows]
+    else:
+        params = rows
+    if params:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+    return len(params)
+
+
+# Address fields of a modem, in the order of the IPAssignment kinds
+ADDRESS_FIELDS = ('public_ip', 'ipv4', 'ipv6')
+
+# Address fields followed by their packed forms, as written by the bulk rotation paths
+PACKED_ADDRESS_FIELDS = (*ADDRESS_FIELDS, 'public_ip_packed', 'ipv4_packed', 'ipv6_packed')
+
+
+def with_packed(addresses):
+    # Append the packed form of every address of a (public_ip, ipv4, ipv6) triple
+    return (*addresses, *map(pack_address, addresses))
+
+
+def publish_rotations(rows):
+    """
+    Publish a 'modem.rotated' event per (modem_id, public_ip, ipv4, ipv6) row once the transaction commits.
+    """
+    if wants_events():
+        publish_on_commit([
+            {'type': 'modem.rotated', 'modem': pk, **dict(zip(ADDRESS_FIELDS, addresses))}
+            for pk, *addresses in rows
+        ])
 
 
 class Modem(models.Model):
@@ -25,55 +109,380 @@ class Modem(models.Model):
     public_ip = models.GenericIPAddressField()
     ipv4 = models.GenericIPAddressField(protocol='IPv4')
     ipv6 = models.GenericIPAddressField(protocol='IPv6')
-    phone_number = models.CharField(max_length=15)
+    phone_number = models.CharField(max_length=15, db_index=True)
 
+    # Packed copies of the addresses, indexed for CIDR range searches
+    public_ip_packed = PackedIPAddressField(source='public_ip', db_index=True)
+    ipv4_packed = PackedIPAddressField(source='ipv4', db_index=True)
+    ipv6_packed = PackedIPAddressField(source='ipv6', db_index=True)
 
     def generate_public_ip(self):
-        return f"{random.randint(1, 255)}.{random.randint(1, 255)}.{random.randint(1, 255)}.{random.randint(1, 255)}"
+        return generate_ipv4_batch(1)[0]
 
     def generate_ipv4(self):
-        return f"{random.randint(1, 255)}.{random.randint(1, 255)}.{random.randint(1, 255)}.{random.randint(1, 255)}"
+        return generate_ipv4_batch(1)[0]
 
     def generate_ipv6(self):
-        segments = [f'{random.randint(0, 65535):04x}' for _ in range(8)]
-
-        # Join the segments to form the IPv6 address
-        ipv6_address = ":".join(segments)
+        return generate_ipv6_batch(1)[0]
 
-        return ipv6_address
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded addresses so save() only records the ones that changed
+        instance._loaded_addresses = tuple(instance.__dict__.get(field) for field in ADDRESS_FIELDS)
+        return instance
 
     # Simulate modem reboot
     def reboot_modem(self):
-        self.public_ip = self.generate_public_ip()
-        self.ipv4 = self.generate_ipv4()
-        self.ipv6 = self.generate_ipv6()
-        self.save()
+        # Only the address columns are written, so changes made to the other fields since this instance was loaded
+        # are never overwritten
+        addresses = generate_address_batch(1)[0]
+        self.assign_addresses([(self.pk, addresses)])
+        for field, value in zip(PACKED_ADDRESS_FIELDS, with_packed(addresses)):
+            setattr(self, field, value)
+        self._loaded_addresses = addresses
 
     # Simulate all modems rotating
     @classmethod
-    def rotate_all(cls):
-        # Retrieve all instances of the Modem model from the database
-        modems = list(cls.objects.all())
+    def rotate_all(cls, chunk_size=None):
+        """
+        Shuffle the (public_ip, ipv4, ipv6) triples among the modems of each chunk of the fleet.
+
+        The fleet is walked in id order in chunks of ROTATION_CHUNK_SIZE modems. The first chunk has a random size,
+        so the chunk boundaries move from one run to the next and addresses travel across the whole fleet over
+        time. Each chunk is read once and its permutation written back with a single prepared UPDATE executed in
+        bulk, in a short transaction of its own, so a concurrent reboot waits for one chunk at most instead of the
+        whole fleet. Where the database supports it the chunk's rows are locked with SELECT ... FOR UPDATE SKIP
+        LOCKED, leaving out the modems being rebooted at that moment; on SQLite each chunk takes the write lock
+        before reading.
+
+        Returns:
+            dict: The number of rotated modems and the elapsed time in milliseconds.
+        """
+        chunk_size = chunk_size or settings.ROTATION_CHUNK_SIZE
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        started = time.perf_counter()
+        rotated = 0
+        last_id = 0
+        limit = randint(1, chunk_size)
+
+        while True:
+            with write_transaction():
+                # Read the current addresses of the next chunk, with their packed forms, in a single query
+                queryset = cls.objects.filter(id__gt=last_id).order_by('id')
+                if skip_locked:
+                    queryset = queryset.select_for_update(skip_locked=True)
+                rows = list(queryset.values_list('id', *PACKED_ADDRESS_FIELDS)[:limit])
+                if not rows:
+                    break
+
+                # Shuffle the address triples and pair them back with the modem ids
+                addresses = [row[1:] for row in rows]
+                shuffle(addresses)
+                bulk_update_by_pk(
+                    cls, PACKED_ADDRESS_FIELDS,
+                    [(row[0], *address) for row, address in zip(rows, addresses)],
+                    prepare=False,
+                )
+                # Append the addresses that moved to the history
+                IPAssignment.record(
+                    (row[0], *(new if new != old else None for old, new in zip(row[1:4], address[:3])))
+                    for row, address in zip(rows, addresses)
+                )
+                publish_rotations(
+                    (row[0], *address[:3]) for row, address in zip(rows, addresses) if address[:3] != row[1:4]
+                )
+                FleetVersion.bump()
 
-        # Shuffle the instances
-        shuffle(modems)
+            last_id = rows[-1][0]
+            rotated += len(rows)
+            limit = chunk_size
 
-        # Use a transaction to ensure atomicity
+        return {
+            'rotated': rotated,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    @classmethod
+    def reboot_many(cls, modem_ids):
+        """
+        Simulate a reboot of every modem in `modem_ids`, granting each one fresh IPs.
+
+        The new addresses come from one generated batch and are written with a single bulk statement.
+        Returns the number of updated rows.
+        """
+        modem_ids = list(modem_ids)
+        return cls.assign_addresses(zip(modem_ids, generate_address_batch(len(modem_ids))))
+
+    @classmethod
+    def assign_addresses(cls, assignments):
+        """
+        Write (modem_id, (public_ip, ipv4, ipv6)) assignments of canonical addresses, with their history.
+
+        The UPDATE of the address columns is the transaction's first statement, so no row is read before it is
+        locked and the other columns of the modems are left untouched. Returns the number of updated rows.
+        """
+        rows = [(pk, *addresses) for pk, addresses in assignments]
+        # Generated addresses are already in their canonical form, no per-value field preparation is needed
         with transaction.atomic():
-            # Update each instance in the original order with the shuffled instances
-            for original_modem, shuffled_modem in zip(cls.objects.all(), modems):
-                original_modem.public_ip = shuffled_modem.public_ip
-                original_modem.ipv4 = shuffled_modem.ipv4
-                original_modem.ipv6 = shuffled_modem.ipv6
-                original_modem.save()
+            updated = bulk_update_by_pk(cls, PACKED_ADDRESS_FIELDS, [
+                (pk, *with_packed(addresses)) for pk, *addresses in rows
+            ], prepare=False)
+            if updated:
+                IPAssignment.record(rows)
+                FleetVersion.bump()
+                publish_rotations(rows)
+        return updated
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_addresses', (None,) * len(ADDRESS_FIELDS))
+        addresses = tuple(getattr(self, field) for field in ADDRESS_FIELDS)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            changed = tuple(new if new != old else None for old, new in zip(loaded, addresses))
+            if any(changed):
+                # Addresses set on the instance may not be canonical yet, so let the fields prepare them
+                IPAssignment.record([(self.pk, *changed)], prepare=True)
+                publish_rotations([(self.pk, *addresses)])
+            FleetVersion.bump()
+        self._loaded_addresses = addresses
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        FleetVersion.bump()
+        return result
 
     def __str__(self):
         return f'{self.model} {self.public_ip}'
 
 
 
+class IPAssignment(models.Model):
+    """
+    Append-only history of the addresses given to modems, one row per address.
+
+    An assignment holds until the same modem is given its next address of the same kind, so the holder of an
+    address at any time is found with two indexed lookups whatever the size of the history.
+    """
+    kind_choices = tuple(enumerate(ADDRESS_FIELDS))
+
+    class Meta:
+        indexes = [
+            # Serves the point-in-time reverse lookup of an address
+            models.Index(fields=['ip', 'assigned_at'], name='ipassignment_ip_time_idx'),
+            # Serves the lookup of the assignment that replaced another one
+            models.Index(fields=['modem', 'kind', 'assigned_at'], name='ipassignment_modem_kind_idx'),
+        ]
+
+    # No foreign key constraint: the history outlives deleted modems and appends never check the Modem table
+    modem = models.ForeignKey(Modem, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                              related_name='ip_assignments')
+    kind = models.PositiveSmallIntegerField(choices=kind_choices)
+    ip = models.GenericIPAddressField()
+    assigned_at = models.DateTimeField()
+
+    @classmethod
+    def record(cls, rows, assigned_at=None, prepare=False):
+        """
+        Append the history of (modem_id, public_ip, ipv4, ipv6) rows, where None marks an unchanged address.
+
+        Rows are written with a single prepared INSERT executed in bulk. Addresses must be canonical unless
+        `prepare` is True. Returns the number of appended rows.
+        """
+        assigned_at = assigned_at or timezone.now()
+        if not prepare:
+            assigned_at = connection.ops.adapt_datetimefield_value(assigned_at)
+        history = [
+            (modem_id, kind, ip, assigned_at)
+            for modem_id, *addresses in rows
+            for kind, ip in enumerate(addresses)
+            if ip is not None
+        ]
+        return bulk_insert(cls, ['modem', 'kind', 'ip', 'assigned_at'], history, prepare=prepare)
+
+    @classmethod
+    def holder_at(cls, ip, at):
+        """
+        Return the assignment through which a modem held `ip` at `at`, or None when no modem held it.
+        """
+        assignment = cls.objects.filter(ip=ip, assigned_at__lte=at).order_by('-assigned_at', '-id').first()
+        if assignment is None:
+            return None
+        # The modem may have been given another address of the same kind before `at`
+        released = cls.objects.filter(
+            modem_id=assignment.modem_id, kind=assignment.kind,
+            assigned_at__gt=assignment.assigned_at, assigned_at__lte=at,
+        ).exists()
+        return None if released else assignment
+
+    def __str__(self):
+        return f'{self.ip} -> modem {self.modem_id} at {self.assigned_at}'
+
+
+class FleetVersion(models.Model):
+    """
+    Fleet-wide change counter, stored in a single row.
+
+    Every write path that changes what the modem listing shows bumps it, so it can be used as an ETag for the
+    listing without reading the Modem table.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    SINGLETON_PK = 1
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=cls.SINGLETON_PK).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        # Increment in the database so concurrent bumps from several processes are never lost
+        if not cls.objects.filter(pk=cls.SINGLETON_PK).update(version=models.F('version') + 1):
+            cls.objects.get_or_create(pk=cls.SINGLETON_PK, defaults={'version': 1})
+
+    def __str__(self):
+        return f'Fleet version {self.version}'
+
+
+class RotationSchedule(models.Model):
+    """
+    Periodic IP rotation of a single modem.
+
+    Due schedules are picked up by the `rotate_due_modems` scanner task, which rotates them in batches and
+    moves `next_due` forward by whole intervals so the rotation keeps its phase.
+    """
+    modem = models.OneToOneField(Modem, on_delete=models.CASCADE, related_name='rotation_schedule')
+    interval = models.DurationField()
+    next_due = models.DateTimeField(db_index=True)
+
+    @classmethod
+    def schedule_many(cls, modem_ids, interval, stagger=False, jitter=None, batch_size=1000):
+        """
+        Create or update the rotation schedule of every modem in `modem_ids` in a single transaction.
+
+        Schedules are upserted with INSERT ... ON CONFLICT in batches, so the number of queries does not depend
+        on how many modems already had a schedule. The first rotation is due one interval from now; with `stagger`
+        the modems are instead spread evenly across the next interval in id order, and a `jitter` timedelta delays
+        each first rotation by a random amount up to it. The scanner keeps that phase for every later rotation.
+        Returns the number of scheduled modems.
+        """
+        now = timezone.now()
+        modem_ids = sorted(modem_ids) if stagger else list(modem_ids)
+        count = len(modem_ids)
+        with transaction.atomic():
+            schedules = []
+            for position, modem_id in enumerate(modem_ids, start=1):
+                next_due = now + (interval * position / count if stagger else interval)
+                if jitter:
+                    next_due += jitter * random.random()
+                schedules.append(cls(modem_id=modem_id, interval=interval, next_due=next_due))
+            cls.objects.bulk_create(
+                schedules,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['modem'],
+                update_fields=['interval', 'next_due'],
+            )
+        return len(schedules)
+
+    def __str__(self):
+        return f'Modem {self.modem_id} every {self.interval}'
+
+
+class PendingRotation(models.Model):
+    """
+    Modem waiting for an on-demand rotation.
+
+    A modem is pending at most once, so repeated requests for it coalesce into one rotation; `flush_rotations`
+    takes the pending modems in batches and rotates each batch with a single bulk reboot.
+    """
+    modem = models.OneToOneField(Modem, on_delete=models.CASCADE, primary_key=True, related_name='pending_rotation')
+    requested_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @classmethod
+    def add(cls, modem_ids, batch_size=1000):
+        # Modems already pending keep their place in the queue
+        cls.objects.bulk_create([cls(modem_id=modem_id) for modem_id in modem_ids], batch_size=batch_size,
+                                ignore_conflicts=True)
+
+    @classmethod
+    def take(cls, limit):
+        """
+        Claim up to `limit` of the oldest pending modems: their rows are deleted and their ids returned.
+
+        Call it in a write_transaction(): where the database supports it the claimed rows are locked, skipping the
+        ones claimed by concurrent workers, and on SQLite the write lock is held before the rows are read.
+        """
+        queryset = cls.objects.order_by('requested_at')
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        modem_ids = list(queryset.values_list('modem_id', flat=True)[:limit])
+        cls.objects.filter(modem_id__in=modem_ids).delete()
+        return modem_ids
+
+    def __str__(self):
+        return f'Modem {self.modem_id} pending since {self.requested_at}'
+
+
+# Process-local cache of the FeatureSettings singleton; 'checked' tells whether its version was compared with the
+# database's since the current request started
+_feature_settings_cache = {'instance': None, 'expires': 0.0, 'checked': False}
+
+
+def recheck_feature_settings(sender, **kwargs):
+    # request_started receiver: the cached singleton's version is compared again by the first load() of the request
+    _feature_settings_cache['checked'] = False
+
+
 class FeatureSettings(models.Model):
     critical_mode_enabled = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def load(cls):
+        """
+        Return the FeatureSettings singleton, creating it with critical mode disabled if it does not exist.
+
+        The instance is cached per process. The first call of each request reads the version alone and re-reads
+        the row only when another process bumped it, so a change is seen by the next request of every worker.
+        Outside of requests (e.g. in Celery tasks) the cached instance is trusted for FEATURE_SETTINGS_CACHE_TTL
+        seconds.
+        """
+        cache = _feature_settings_cache
+        now = time.monotonic()
+        instance = cache['instance']
+        if instance is not None and now < cache['expires']:
+            if cache['checked']:
+                return instance
+            cache['checked'] = True
+            version = cls.objects.filter(pk=instance.pk).values_list('version', flat=True).first()
+            if version == instance.version:
+                return instance
+
+        instance = cls.objects.first()
+        if instance is None:
+            instance = cls.objects.create(critical_mode_enabled=False)
+        cache.update(instance=instance, expires=now + settings.FEATURE_SETTINGS_CACHE_TTL, checked=True)
+        return instance
+
+    @classmethod
+    def invalidate_cache(cls):
+        _feature_settings_cache.update(instance=None, expires=0.0, checked=False)
+
+    def set_critical_mode(self, enabled):
+        # Update the flag and bump the version atomically, then drop this process' cached copy
+        FeatureSettings.objects.filter(pk=self.pk).update(
+            critical_mode_enabled=enabled,
+            version=models.F('version') + 1,
+        )
+        self.refresh_from_db()
+        FeatureSettings.invalidate_cache()
+        # Masking changes every listed modem
+        FleetVersion.bump()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        FeatureSettings.invalidate_cache()
 
     def __str__(self):
-        return f'Critical Mode Enabled: {self.critical_mode_enabled}'
\ No newline at end of file
+        return f'Critical Mode Enabled: {self.critical_mode_enabled}'
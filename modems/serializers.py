@@ -1,31 +1,49 @@
+from django.conf import settings
+from django.utils.functional import cached_property
 from rest_framework import serializers
-from .models import Modem, FeatureSettings
+from .ip import packed_range
+from .models import ADDRESS_FIELDS, Modem, FeatureSettings, IPAssignment
+
+
+# Modem fields exposed by the API; the packed address columns are internal
+MODEM_FIELDS = ('id', 'model', 'carrier', 'public_ip', 'ipv4', 'ipv6', 'phone_number')
+
+
+def critical_mode_template():
+    # Masked modem in ModemSerializer field order; every field but the id comes from the CRITICAL_MODE_MASKS setting
+    return {
+        field: None if field == 'id' else settings.CRITICAL_MODE_MASKS.get(field, settings.CRITICAL_MODE_DEFAULT_MASK)
+        for field in MODEM_FIELDS
+    }
+
+
+def mask_modem(pk, template=None):
+    # Copy the masked template and fill in the only real value, the primary key
+    data = dict(template or critical_mode_template())
+    data['id'] = pk
+    return data
 
 
 class ModemSerializer(serializers.ModelSerializer):
     class Meta:
         model = Modem
-        fields = '__all__'
+        fields = MODEM_FIELDS
 
 
-class CriticalModemSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Modem
-        fields = '__all__'
+class CriticalModemSerializer(serializers.BaseSerializer):
+    """
+    Masked representation of modems, only selected when critical_mode_enabled is True.
+
+    Only the primary key of each modem is read, so the serialized rows may be modems or values('id') dicts.
+    """
+
+    @cached_property
+    def template(self):
+        return critical_mode_template()
 
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        # Scramble the response when critical_mode_enabled is True
-        if FeatureSettings.objects.exists() and FeatureSettings.objects.first().critical_mode_enabled:
-            # Mask IP fields
-            data['public_ip'] = '***.***.***.***'
-            data['ipv4'] = '***.***.***.***'
-            data['ipv6'] = '****:****:****:****:****:****:****:****'
-            # Mask all other fields (excluding IP fields)
-            for field in data:
-                if field not in ['id','public_ip', 'ipv4', 'ipv6']:
-                    data[field] = '********'
-        return data
+        pk = instance['id'] if isinstance(instance, dict) else instance.pk
+        return mask_modem(pk, self.template)
 
 
 class FeatureSettingsSerializer(serializers.ModelSerializer):
@@ -37,13 +55,77 @@ class FeatureSettingsSerializer(serializers.ModelSerializer):
 
 class RotationParamsSerializer(serializers.Serializer):
 
-    index = serializers.CharField(max_length=10)
+    # 'all', a single modem id or a comma-separated list of modem ids
+    index = serializers.CharField(max_length=10000)
+    carrier = serializers.ChoiceField(choices=Modem.carrier_choices, required=False)
+    model = serializers.ChoiceField(choices=Modem.model_choices, required=False)
     day = serializers.IntegerField(min_value=0, max_value=29, required=False)
     hour = serializers.IntegerField(min_value=0, max_value=22, required=False)
     min = serializers.IntegerField(min_value=0, max_value=58, required=False)
+    # Spread the first rotations across the interval, and delay each by up to 'jitter' random seconds
+    stagger = serializers.BooleanField(default=False)
+    jitter = serializers.IntegerField(min_value=0, max_value=86400, required=False)
+
+    def validate_index(self, value):
+        if value.lower() == 'all':
+            return 'all'
+        try:
+            return [int(modem_id) for modem_id in value.split(',')]
+        except ValueError:
+            raise serializers.ValidationError("Index must be 'all' or a comma-separated list of modem ids.")
 
     def validate(self, data):
         count = sum(param is not None for param in [data.get('day'), data.get('hour'), data.get('min')])
         if count != 1:
             raise serializers.ValidationError("Please provide exactly one interval parameter.")
-        return data
\ No newline at end of file
+        return data
+
+
+class BulkRebootParamsSerializer(serializers.Serializer):
+
+    # Select modems by explicit ids, an inclusive id range and/or carrier/model filters
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    start = serializers.IntegerField(min_value=1, required=False)
+    end = serializers.IntegerField(min_value=1, required=False)
+    carrier = serializers.ChoiceField(choices=Modem.carrier_choices, required=False)
+    model = serializers.ChoiceField(choices=Modem.model_choices, required=False)
+    # Queue the reboots for a worker instead of rebooting during the request
+    queue = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if ('start' in data) != ('end' in data):
+            raise serializers.ValidationError("Please provide both 'start' and 'end' for an id range.")
+        if 'start' in data and data['start'] > data['end']:
+            raise serializers.ValidationError("'start' must not be greater than 'end'.")
+        if not any(field in data for field in ('ids', 'start', 'carrier', 'model')):
+            raise serializers.ValidationError("Please provide 'ids', an id range or a carrier/model filter.")
+        return data
+
+class IPLookupParamsSerializer(serializers.Serializer):
+
+    # The address to resolve and the point in time, now when omitted
+    ip = serializers.IPAddressField()
+    at = serializers.DateTimeField(required=False)
+
+
+class IPAssignmentSerializer(serializers.ModelSerializer):
+
+    kind = serializers.CharField(source='get_kind_display')
+
+    class Meta:
+        model = IPAssignment
+        fields = ('ip', 'modem', 'kind', 'assigned_at')
+
+
+class CIDRSearchParamsSerializer(serializers.Serializer):
+
+    # The CIDR block to search and the address field it applies to
+    cidr = serializers.CharField()
+    field = serializers.ChoiceField(choices=ADDRESS_FIELDS, default='public_ip')
+
+    def validate_cidr(self, value):
+        # Return the first and last packed addresses of the block
+        try:
+            return packed_range(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid CIDR block. Please provide a block like '10.20.0.0/16'.")
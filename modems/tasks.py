@@ -1,8 +1,101 @@
+import time
+
 from celery import shared_task
-from .models import Modem
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.db import write_transaction
+from .models import Modem, PendingRotation, RotationSchedule, bulk_update_by_pk
+
+
+def request_rotations(modem_ids):
+    """
+    Queue an on-demand rotation of every modem in `modem_ids` and enqueue a task to carry them out.
+
+    Modems already waiting are not queued twice, and however many flush tasks pile up, the first one to run
+    rotates every pending modem; the others find nothing left to do.
+    """
+    PendingRotation.add(modem_ids)
+    transaction.on_commit(flush_rotations.delay)
+
+
+@shared_task
+def flush_rotations(batch_size=None):
+    """
+    Rotate every pending modem, in batches of ROTATION_SCAN_BATCH_SIZE rotated by one bulk reboot each.
+    """
+    batch_size = batch_size or settings.ROTATION_SCAN_BATCH_SIZE
+    rotated = 0
+    while True:
+        with write_transaction():
+            modem_ids = PendingRotation.take(batch_size)
+            if not modem_ids:
+                break
+            rotated += Modem.reboot_many(modem_ids)
+    return {'rotated': rotated}
 
 
 @shared_task
 def rotate_ip(modem_id):
-    modem = Modem.objects.get(pk=modem_id)
-    modem.reboot_modem()
+    """
+    Queue a rotation of one modem, to be carried out by flush_rotations.
+
+    A flush is enqueued only when the modem was not pending yet, so a backlog of messages for the same modem
+    collapses into one rotation, made by the flush queued behind them.
+    """
+    if not Modem.objects.filter(pk=modem_id).exists():
+        return {'queued': False}
+    _, created = PendingRotation.objects.get_or_create(modem_id=modem_id)
+    if created:
+        transaction.on_commit(flush_rotations.delay)
+    return {'queued': created}
+
+
+def next_due_after(next_due, interval, now):
+    # Skip the ticks missed while the scanner was not running but keep the original phase
+    missed = (now - next_due) // interval
+    return next_due + interval * (missed + 1)
+
+
+@shared_task
+def rotate_due_modems(batch_size=None, max_rotations=None):
+    """
+    Rotate every modem whose rotation schedule is due and move its `next_due` forward.
+
+    Due schedules are processed in batches of ROTATION_SCAN_BATCH_SIZE, each batch in its own transaction,
+    so a single periodic task replaces one beat entry per modem. At most ROTATION_SCAN_MAX_ROTATIONS modems are
+    rotated per run (0 for no limit); the most overdue go first and the rest stay due for the next run, so the
+    write load never exceeds that many rotations per scan interval.
+    """
+    batch_size = batch_size or settings.ROTATION_SCAN_BATCH_SIZE
+    if max_rotations is None:
+        max_rotations = settings.ROTATION_SCAN_MAX_ROTATIONS
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    started = time.perf_counter()
+    now = timezone.now()
+    rotated = 0
+
+    while not max_rotations or rotated < max_rotations:
+        if max_rotations:
+            batch_size = min(batch_size, max_rotations - rotated)
+        # Lock before reading the batch, so overlapping scanner runs never rotate the same schedules twice
+        with write_transaction():
+            due = RotationSchedule.objects.filter(next_due__lte=now).order_by('next_due')
+            if skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            due = list(due.values_list('id', 'modem_id', 'next_due', 'interval')[:batch_size])
+            if not due:
+                break
+
+            Modem.reboot_many([modem_id for _, modem_id, _, _ in due])
+            bulk_update_by_pk(RotationSchedule, ['next_due'], [
+                (pk, next_due_after(next_due, interval, now)) for pk, _, next_due, interval in due
+            ])
+            rotated += len(due)
+
+    return {
+        'rotated': rotated,
+        'remaining': RotationSchedule.objects.filter(next_due__lte=now).count(),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
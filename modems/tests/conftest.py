@@ -1,13 +1,35 @@
 import pytest
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
-from modems.models import Modem
+from modems.async_views import critical_mode
+from modems.cache import modem_list_cache
+from modems.models import Modem, FeatureSettings
 
 User = get_user_model()
 
 
+@pytest.fixture(autouse=True)
+def clear_feature_settings_cache():
+    # The FeatureSettings singleton is cached per process; never leak it across tests
+    FeatureSettings.invalidate_cache()
+    critical_mode.reset()
+    yield
+    FeatureSettings.invalidate_cache()
+    critical_mode.reset()
+
+
+@pytest.fixture(autouse=True)
+def clear_modem_list_cache():
+    # Fleet versions restart with every test database, so cached pages must not survive a test
+    modem_list_cache.backend.clear()
+    modem_list_cache.reset_stats()
+    yield
+    modem_list_cache.backend.clear()
+
+
 @pytest.fixture
 def api_client():
     client = APIClient()
@@ -49,6 +71,19 @@ def modem():
 
 
 
+@pytest.fixture
+def large_fleet():
+    # Grow the fleet by 50 modems, for tests asserting that a query count does not depend on the fleet size
+    def create():
+        Modem.objects.bulk_create([
+            Modem(model='USB', carrier='AT&T', public_ip=f'10.0.0.{i}', ipv4=f'10.0.1.{i}',
+                  ipv6=f'2001:db8::{i:x}', phone_number='123456789')
+            for i in range(1, 51)
+        ])
+
+    return create
+
+
 @pytest.fixture
 def logged_in_user_token():
     # Create a user account
@@ -61,3 +96,11 @@ def logged_in_user_token():
     token, created = Token.objects.get_or_create(user=user)
 
     return token.key
+
+
+@pytest.fixture
+def token_cached_client(api_client, logged_in_user_token):
+    # Authenticate once so every request measured by the test is served by the token cache
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    api_client.get(reverse('metrics'))
+    return api_client
@@ -0,0 +1,157 @@
+import threading
+from itertools import groupby
+
+import pytest
+from django.conf import settings
+from django.db import connection, connections
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.db_routers import PrimaryReplicaRouter, use_primary
+from modems.ip import generate_address_batch
+from modems.models import ADDRESS_FIELDS, FeatureSettings, FleetVersion, IPAssignment, Modem
+from sms.models import SMS
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    # Declare a replica alias for the router without opening a second database
+    monkeypatch.setitem(settings.DATABASES, 'replica', settings.DATABASES['default'])
+
+
+def test_router_sends_listing_reads_to_replica(replica):
+    router = PrimaryReplicaRouter()
+
+    assert router.db_for_read(Modem) == 'replica'
+    assert router.db_for_read(SMS) == 'replica'
+    assert router.db_for_read(FleetVersion) == 'replica'
+    # Critical mode must never lag behind
+    assert router.db_for_read(FeatureSettings) is None
+    assert router.db_for_write(Modem) == 'default'
+
+    with use_primary():
+        assert router.db_for_read(Modem) == 'default'
+
+
+def test_router_without_replica():
+    assert PrimaryReplicaRouter().db_for_read(Modem) is None
+
+
+@pytest.mark.django_db
+def test_router_keeps_transactions_on_primary(replica):
+    # Rotations read and write inside a transaction on the primary
+    assert connection.in_atomic_block
+    assert PrimaryReplicaRouter().db_for_read(Modem) == 'default'
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Exercises the tuned SQLite profile')
+def test_reads_and_rotations_in_parallel(modem, logged_in_user_token):
+    FeatureSettings.load()
+    errors = []
+    statuses = []
+    rotating = threading.Event()
+    rotating.set()
+
+    def rotate():
+        try:
+            for _ in range(20):
+                Modem.rotate_all()
+                Modem.reboot_many(Modem.objects.values_list('id', flat=True))
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            rotating.clear()
+            connections.close_all()
+
+    def read():
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+        try:
+            while rotating.is_set():
+                statuses.append(client.get(reverse('modem-list'), {'page_size': 3}).status_code)
+                statuses.append(client.get(reverse('sms-list-index')).status_code)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=rotate)] + [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert statuses and set(statuses) == {status.HTTP_200_OK}
+    assert Modem.objects.count() == 3
+
+
+def replay_history():
+    """
+    Replay the IP history transaction by transaction and return the addresses it ends with per (modem, kind).
+
+    An address assigned by a transaction must be brand new or held by a modem right before it: one that was
+    replaced earlier and comes back was written from a stale read, i.e. an update was lost.
+    """
+    held = {}
+    seen = set()
+    rows = IPAssignment.objects.order_by('id').values_list('assigned_at', 'modem_id', 'kind', 'ip')
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        holding = {(kind, ip) for (_, kind), ip in held.items()}
+        for _, modem_id, kind, ip in group:
+            assert (kind, ip) not in seen or (kind, ip) in holding, f'{ip} was resurrected on modem {modem_id}'
+            held[modem_id, kind] = ip
+            seen.add((kind, ip))
+    return held
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Exercises the chunked SQLite transactions')
+def test_reboots_and_rotations_in_parallel():
+    for public_ip, ipv4, ipv6 in generate_address_batch(30):
+        Modem.objects.create(model='USB', carrier='AT&T', public_ip=public_ip, ipv4=ipv4, ipv6=ipv6,
+                             phone_number='0')
+    # Reboots work on instances loaded before every other change
+    modems = list(Modem.objects.all())
+    errors = []
+
+    def run(work):
+        try:
+            work()
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connections.close_all()
+
+    def rotate():
+        for _ in range(15):
+            Modem.rotate_all(chunk_size=7)
+
+    def reboot(instances):
+        for _ in range(5):
+            for modem in instances:
+                modem.reboot_modem()
+
+    def renumber():
+        for number in range(1, 51):
+            Modem.objects.update(phone_number=str(number))
+
+    threads = [threading.Thread(target=run, args=(work,)) for work in [
+        rotate, renumber, lambda: reboot(modems[::2]), lambda: reboot(modems[1::2]),
+    ]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    # Reboots never write back stale columns
+    assert set(Modem.objects.values_list('phone_number', flat=True)) == {'50'}
+    # Every change is in the history and no address came back from a stale read
+    held = replay_history()
+    for modem in Modem.objects.all():
+        assert tuple(held[modem.pk, kind] for kind in range(len(ADDRESS_FIELDS))) == tuple(
+            getattr(modem, field) for field in ADDRESS_FIELDS
+        )
@@ -1,9 +1,24 @@
+import asyncio
+import ipaddress
+import json
+import random
+from datetime import timedelta
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django_celery_beat.models import PeriodicTask
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 
-from modems.models import FeatureSettings, Modem
+from core.events import InProcessBroker, RedisBroker, get_broker
+from modems.async_views import EventStreamApplication, critical_mode
+from modems.ip import generate_address_batch, generate_ipv4_batch, generate_ipv6_batch, pack_address, packed_range
+from modems.models import FeatureSettings, FleetVersion, IPAssignment, Modem, PendingRotation, RotationSchedule
+from modems.tasks import flush_rotations, request_rotations, rotate_due_modems, rotate_ip
 
 
 @pytest.mark.django_db
@@ -65,6 +80,44 @@ def test_critical_mode_enabled(api_client, logged_in_user_token, modem):
     assert response.data['results'][0]['ipv6'] == '****:****:****:****:****:****:****:****'
 
 
+@pytest.mark.django_db
+def test_critical_mode_reads_only_ids(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+
+    url = reverse('modem-list')
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url)
+
+    modem_queries = [q['sql'] for q in context.captured_queries if 'modems_modem' in q['sql']]
+    assert response.data['results'][0] == {
+        'id': Modem.objects.first().id,
+        'model': '********',
+        'carrier': '********',
+        'public_ip': '***.***.***.***',
+        'ipv4': '***.***.***.***',
+        'ipv6': '****:****:****:****:****:****:****:****',
+        'phone_number': '********',
+    }
+    assert not [sql for sql in modem_queries if '"modems_modem"."ipv4"' in sql]
+
+
+@pytest.mark.django_db
+def test_critical_mode_masks_are_configurable(api_client, logged_in_user_token, modem, settings):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    settings.CRITICAL_MODE_DEFAULT_MASK = 'hidden'
+    settings.CRITICAL_MODE_MASKS = {'ipv4': 'x.x.x.x'}
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+
+    row = api_client.get(reverse('modem-list')).data['results'][0]
+
+    assert row['ipv4'] == 'x.x.x.x'
+    assert row['ipv6'] == 'hidden'
+    assert row['phone_number'] == 'hidden'
+
+
 @pytest.mark.django_db
 def test_update_critical_mode_enabled(api_client, logged_in_user_token):
     api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
@@ -136,11 +189,10 @@ def test_custom_modem_rotation(api_client, logged_in_user_token, modem):
     index = 1
     response = api_client.get(url, {'index': index, 'min': 1})
 
-    task_name = f'Rotating IP for Modem {index}'
-    task = PeriodicTask.objects.get(name=task_name)
+    schedule = RotationSchedule.objects.get(modem_id=index)
 
-    assert task is not None
-    assert task.interval.every == 1
+    assert schedule.interval == timedelta(minutes=1)
+    assert schedule.next_due > timezone.now()
     assert response.status_code == status.HTTP_200_OK
 
 
@@ -151,8 +203,9 @@ def test_all_modem_rotation(api_client, logged_in_user_token, modem):
     url = reverse('custom-rot')
     response = api_client.get(url, {'index': 'all', 'min': 1})
 
-    tasks = PeriodicTask.objects.all()
-    assert len(tasks) == 3
+    assert RotationSchedule.objects.count() == 3
+    # No per-modem beat entries are created any more
+    assert not PeriodicTask.objects.filter(task='modems.tasks.rotate_ip').exists()
     assert response.status_code == status.HTTP_200_OK
 
 
@@ -174,3 +227,930 @@ def test_modem_rotation_0_min(api_client, logged_in_user_token, modem):
     response = api_client.get(url, {'index': 1, 'min': 0})
 
     assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_rotate_all_modems(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    addresses_before = sorted(Modem.objects.values_list('public_ip', 'ipv4', 'ipv6'))
+
+    url = reverse('rotate-all-modems')
+    response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['rotated'] == 3
+    assert 'elapsed_ms' in response.data
+    # Rotation only permutes the address triples across the fleet
+    assert sorted(Modem.objects.values_list('public_ip', 'ipv4', 'ipv6')) == addresses_before
+
+
+@pytest.mark.django_db
+def test_rotate_all_constant_queries(modem, large_fleet, monkeypatch):
+    # A random shuffle may leave every address in place and skip the history insert, and a random first chunk
+    # size may split the fleet in two chunks
+    monkeypatch.setattr('modems.models.shuffle', list.reverse)
+    monkeypatch.setattr('modems.models.randint', lambda low, high: high)
+
+    with CaptureQueriesContext(connection) as small_fleet_queries:
+        Modem.rotate_all()
+
+    large_fleet()
+
+    with CaptureQueriesContext(connection) as large_fleet_queries:
+        Modem.rotate_all()
+
+    assert len(large_fleet_queries.captured_queries) == len(small_fleet_queries.captured_queries)
+
+
+@pytest.mark.django_db
+def test_critical_mode_list_reads_settings_once(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+
+    url = reverse('modem-list')
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url)
+
+    settings_queries = [q for q in context.captured_queries if 'modems_featuresettings' in q['sql']]
+    assert response.status_code == status.HTTP_200_OK
+    assert len(settings_queries) == 1
+
+    # A second request only checks the version of the process-local copy
+    with CaptureQueriesContext(connection) as context:
+        api_client.get(url)
+
+    settings_queries = [q for q in context.captured_queries if 'modems_featuresettings' in q['sql']]
+    assert len(settings_queries) == 1
+    assert 'critical_mode_enabled' not in settings_queries[0]['sql']
+
+
+@pytest.mark.django_db
+def test_critical_mode_change_from_another_process(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    FeatureSettings.objects.create(critical_mode_enabled=False)
+    assert api_client.get(reverse('modem-list')).data['results'][0]['public_ip'] == '192.168.1.1'
+
+    # Another worker toggles the flag: this process' cache is not invalidated, the version tells
+    FeatureSettings.objects.update(critical_mode_enabled=True, version=models.F('version') + 1)
+    FleetVersion.bump()
+
+    assert api_client.get(reverse('modem-list')).data['results'][0]['public_ip'] == '***.***.***.***'
+
+
+@pytest.mark.django_db
+def test_update_critical_mode_bumps_version(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    FeatureSettings.objects.create(critical_mode_enabled=False)
+    # Warm the cache with the disabled flag
+    assert FeatureSettings.load().critical_mode_enabled is False
+
+    response = api_client.put(reverse('critical-mode-update') + '?toggle=enable')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert FeatureSettings.objects.get().version == 1
+    # The toggle invalidates the cached singleton so the next listing is masked right away
+    response = api_client.get(reverse('modem-list'))
+    assert response.data['results'][0]['public_ip'] == '***.***.***.***'
+
+
+@pytest.mark.django_db
+def test_modem_list_cursor_pagination(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    response = api_client.get(url, {'pagination': 'cursor', 'page_size': 2, 'count': 'false'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert 'count' not in response.data
+    assert [m['model'] for m in response.data['results']] == ['USB', 'Android']
+
+    response = api_client.get(response.data['next'])
+
+    assert [m['model'] for m in response.data['results']] == ['iPhone']
+    assert response.data['next'] is None
+
+
+@pytest.mark.django_db
+def test_rotate_due_modems(modem):
+    now = timezone.now()
+    due_modem, idle_modem = Modem.objects.all()[:2]
+    RotationSchedule.objects.create(modem=due_modem, interval=timedelta(minutes=5),
+                                    next_due=now - timedelta(minutes=12))
+    RotationSchedule.objects.create(modem=idle_modem, interval=timedelta(minutes=5),
+                                    next_due=now + timedelta(minutes=1))
+
+    stats = rotate_due_modems()
+
+    assert stats['rotated'] == 1
+    assert Modem.objects.get(pk=due_modem.pk).public_ip != due_modem.public_ip
+    assert Modem.objects.get(pk=idle_modem.pk).public_ip == idle_modem.public_ip
+    # Missed ticks are skipped and the schedule keeps its phase
+    next_due = RotationSchedule.objects.get(modem=due_modem).next_due
+    assert next_due > timezone.now()
+    assert (next_due - (now - timedelta(minutes=12))) % timedelta(minutes=5) == timedelta(0)
+
+
+@pytest.mark.django_db
+def test_clear_rotation_schedules(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    api_client.get(reverse('custom-rot'), {'index': 'all', 'min': 1})
+    response = api_client.get(reverse('clear-rot'))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert not RotationSchedule.objects.exists()
+
+
+@pytest.mark.django_db
+def test_all_modem_rotation_constant_queries(token_cached_client, modem, large_fleet):
+    url = reverse('custom-rot')
+    with CaptureQueriesContext(connection) as small_fleet_queries:
+        token_cached_client.get(url, {'index': 'all', 'min': 1})
+
+    large_fleet()
+
+    # Rescheduling updates the existing schedules and creates the missing ones
+    with CaptureQueriesContext(connection) as large_fleet_queries:
+        response = token_cached_client.get(url, {'index': 'all', 'min': 2})
+
+    assert response.data['scheduled'] == 53
+    assert len(large_fleet_queries.captured_queries) == len(small_fleet_queries.captured_queries)
+    assert set(RotationSchedule.objects.values_list('interval', flat=True)) == {timedelta(minutes=2)}
+
+
+@pytest.mark.django_db
+def test_modem_list_rotation(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    first, second, third = Modem.objects.values_list('id', flat=True)
+
+    url = reverse('custom-rot')
+    response = api_client.get(url, {'index': f'{first},{third},999', 'min': 1})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['scheduled'] == 2
+    assert set(RotationSchedule.objects.values_list('modem_id', flat=True)) == {first, third}
+
+
+@pytest.mark.django_db
+def test_filtered_modem_rotation(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('custom-rot')
+    response = api_client.get(url, {'index': 'all', 'carrier': 'Verizon', 'hour': 1})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['scheduled'] == 1
+    assert RotationSchedule.objects.get().modem.carrier == 'Verizon'
+
+
+@pytest.mark.django_db
+def test_modem_rotation_invalid_index(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('custom-rot')
+    response = api_client.get(url, {'index': '1,two', 'min': 1})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_async_list_modems(logged_in_user_token, modem, async_get):
+    response = async_get(reverse('async-modem-list'), {'page_size': 2},
+                         AUTHORIZATION='Token ' + logged_in_user_token)
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data['count'] == 3
+    assert [m['model'] for m in data['results']] == ['USB', 'Android']
+
+    response = async_get(data['next'], AUTHORIZATION='Token ' + logged_in_user_token)
+
+    assert [m['model'] for m in response.json()['results']] == ['iPhone']
+
+
+@pytest.mark.django_db
+def test_async_list_modems_unauthenticated(modem, async_get):
+    response = async_get(reverse('async-modem-list'))
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_async_reboot_modem(logged_in_user_token, modem, async_get):
+    first_modem = Modem.objects.first()
+
+    response = async_get(reverse('async-reboot-modem'), {'index': first_modem.pk},
+                         AUTHORIZATION='Token ' + logged_in_user_token)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert Modem.objects.get(pk=first_modem.pk).public_ip != first_modem.public_ip
+
+
+def test_generate_address_batch_is_reproducible():
+    assert generate_address_batch(100, rng=random.Random(42)) == generate_address_batch(100, rng=random.Random(42))
+    assert generate_address_batch(100, rng=random.Random(42)) != generate_address_batch(100, rng=random.Random(43))
+
+
+def test_generate_ipv4_batch_addresses():
+    addresses = generate_ipv4_batch(20000, rng=random.Random(0))
+
+    assert len(set(addresses)) == len(addresses) == 20000
+    for address in addresses:
+        assert ipaddress.IPv4Address(address).is_global
+        assert '0' not in address.split('.')
+
+
+def test_generate_ipv6_batch_addresses():
+    addresses = generate_ipv6_batch(20000, rng=random.Random(0))
+
+    assert len(set(addresses)) == len(addresses) == 20000
+    for address in addresses:
+        parsed = ipaddress.IPv6Address(address)
+        assert parsed in ipaddress.IPv6Network('2000::/3')
+        assert parsed not in ipaddress.IPv6Network('2001:db8::/32')
+        # Stored as Django would normalize it
+        assert address == parsed.compressed
+
+
+@pytest.mark.django_db
+def test_bulk_reboot_by_ids(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    first, second, third = Modem.objects.all()
+
+    url = reverse('bulk-reboot-modems')
+    response = api_client.post(url, {'ids': [first.pk, third.pk, 999]}, format='json')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['ids'] == [first.pk, third.pk]
+    assert Modem.objects.get(pk=first.pk).public_ip != first.public_ip
+    assert Modem.objects.get(pk=second.pk).public_ip == second.public_ip
+    assert Modem.objects.get(pk=third.pk).ipv6 != third.ipv6
+
+
+@pytest.mark.django_db
+def test_bulk_reboot_by_range_and_filter(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    first, second, third = Modem.objects.values_list('id', flat=True)
+
+    url = reverse('bulk-reboot-modems')
+    response = api_client.post(url, {'start': first, 'end': second}, format='json')
+
+    assert response.data['ids'] == [first, second]
+
+    response = api_client.post(url, {'carrier': 'T-Mobile'}, format='json')
+
+    assert response.data['ids'] == [third]
+
+
+@pytest.mark.django_db
+def test_bulk_reboot_constant_queries(token_cached_client, modem, large_fleet):
+    url = reverse('bulk-reboot-modems')
+    with CaptureQueriesContext(connection) as small_fleet_queries:
+        token_cached_client.post(url, {'model': 'USB'}, format='json')
+
+    large_fleet()
+
+    with CaptureQueriesContext(connection) as large_fleet_queries:
+        response = token_cached_client.post(url, {'model': 'USB'}, format='json')
+
+    assert response.data['rebooted'] == 51
+    assert len(large_fleet_queries.captured_queries) == len(small_fleet_queries.captured_queries)
+
+
+@pytest.mark.django_db
+def test_bulk_reboot_invalid_params(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('bulk-reboot-modems')
+
+    assert api_client.post(url, {}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+    assert api_client.post(url, {'start': 5}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+    assert api_client.post(url, {'ids': [999]}, format='json').status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_modem_list_conditional_get(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    response = api_client.get(url)
+    etag = response['ETag']
+
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response['ETag'] == etag
+    assert not [q for q in context.captured_queries if 'modems_modem' in q['sql']]
+
+
+@pytest.mark.django_db
+def test_modem_list_etag_changes_with_fleet(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    etags = {api_client.get(url)['ETag']}
+
+    # Every write path that changes the listing invalidates the ETag
+    Modem.objects.first().reboot_modem()
+    etags.add(api_client.get(url)['ETag'])
+    Modem.rotate_all()
+    etags.add(api_client.get(url)['ETag'])
+    Modem.reboot_many(Modem.objects.values_list('id', flat=True))
+    etags.add(api_client.get(url)['ETag'])
+    api_client.put(reverse('critical-mode-update') + '?toggle=enable')
+    etags.add(api_client.get(url)['ETag'])
+
+    assert len(etags) == 5
+
+
+@pytest.mark.django_db
+def test_modem_list_page_cache(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    first = api_client.get(url)
+
+    with CaptureQueriesContext(connection) as context:
+        second = api_client.get(url)
+
+    assert first['X-Cache'] == 'MISS'
+    assert second['X-Cache'] == 'HIT'
+    assert second.data == first.data
+    assert not [q for q in context.captured_queries if 'modems_modem' in q['sql']]
+
+    # Other pages and page sizes are cached separately
+    assert api_client.get(url, {'page_size': 1})['X-Cache'] == 'MISS'
+    assert api_client.get(url, {'page_size': 1, 'page': 2})['X-Cache'] == 'MISS'
+
+    metrics = api_client.get(reverse('metrics')).data['modem_list_cache']
+    assert metrics['hits'] == 1
+    assert metrics['misses'] == 3
+
+
+@pytest.mark.django_db
+def test_modem_list_page_cache_invalidation(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    api_client.get(url)
+
+    # A reboot makes the cached page unreachable
+    Modem.objects.first().reboot_modem()
+    response = api_client.get(url)
+    assert response['X-Cache'] == 'MISS'
+    assert response.data['results'][0]['ipv4'] == Modem.objects.first().ipv4
+
+    # Masked pages never come from the unmasked entry
+    api_client.put(reverse('critical-mode-update') + '?toggle=enable')
+    response = api_client.get(url)
+    assert response['X-Cache'] == 'MISS'
+    assert response.data['results'][0]['ipv4'] == '***.***.***.***'
+
+
+@pytest.mark.django_db
+def test_modem_list_fast_path_matches(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    for critical in ('disable', 'enable'):
+        api_client.put(reverse('critical-mode-update') + f'?toggle={critical}')
+        for params in ({}, {'page_size': 2, 'page': 2}, {'pagination': 'cursor', 'page_size': 2}):
+            regular = api_client.get(url, {**params, 'fast': 'false'})
+            fast = api_client.get(url, {**params, 'fast': 'true'})
+
+            assert fast.status_code == status.HTTP_200_OK
+            assert fast.content.replace(b'fast=true', b'fast=false') == regular.content
+
+
+@pytest.mark.django_db
+def test_ip_history_written_by_every_rotation_path(modem):
+    modem_ids = list(Modem.objects.values_list('id', flat=True))
+    # Creating the three modems recorded their three addresses
+    assert IPAssignment.objects.count() == 9
+
+    Modem.objects.get(id=modem_ids[0]).reboot_modem()
+    assert IPAssignment.objects.count() == 12
+
+    Modem.reboot_many(modem_ids[1:])
+    assert IPAssignment.objects.count() == 18
+
+    # Only the addresses that moved are recorded by a fleet-wide shuffle
+    before = dict((pk, row) for pk, *row in Modem.objects.values_list('id', 'public_ip', 'ipv4', 'ipv6'))
+    Modem.rotate_all()
+    after = dict((pk, row) for pk, *row in Modem.objects.values_list('id', 'public_ip', 'ipv4', 'ipv6'))
+    moved = sum(old != new for pk in before for old, new in zip(before[pk], after[pk]))
+    assert IPAssignment.objects.count() == 18 + moved
+
+    # The latest assignment of every modem matches its current addresses
+    for pk, addresses in after.items():
+        for kind, ip in enumerate(addresses):
+            latest = IPAssignment.objects.filter(modem_id=pk, kind=kind).order_by('-assigned_at', '-id').first()
+            assert latest.ip == ip
+
+
+@pytest.mark.django_db
+def test_ip_history_lookup(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    rebooted = Modem.objects.first()
+    old_ip = rebooted.ipv4
+    before_reboot = timezone.now()
+    rebooted.reboot_modem()
+
+    url = reverse('ip-history')
+    response = api_client.get(url, {'ip': old_ip, 'at': before_reboot.isoformat()})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['modem'] == rebooted.id
+    assert response.data['kind'] == 'ipv4'
+
+    # The address was released by the reboot
+    assert api_client.get(url, {'ip': old_ip}).status_code == status.HTTP_404_NOT_FOUND
+
+    response = api_client.get(url, {'ip': rebooted.ipv6})
+    assert response.data['modem'] == rebooted.id
+    assert response.data['kind'] == 'ipv6'
+
+    assert api_client.get(url, {'ip': 'not-an-ip'}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_ip_history_refused_in_critical_mode(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+
+    response = api_client.get(reverse('ip-history'), {'ip': Modem.objects.first().ipv4})
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert 'modem' not in response.data
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Query plan assertions target SQLite')
+def test_ip_history_lookup_uses_indexes():
+    at = timezone.now()
+    plan = IPAssignment.objects.filter(ip='1.2.3.4', assigned_at__lte=at).order_by('-assigned_at', '-id').explain()
+    assert 'ipassignment_ip_time_idx' in plan
+
+    plan = IPAssignment.objects.filter(modem_id=1, kind=1, assigned_at__gt=at).explain()
+    assert 'ipassignment_modem_kind_idx' in plan
+
+
+@pytest.mark.django_db
+def test_packed_addresses_kept_in_sync(modem):
+    def assert_in_sync():
+        for modem in Modem.objects.all():
+            # IPv4 addresses are stored mapped into ::ffff:0:0/96
+            assert bytes(modem.public_ip_packed) == ipaddress.IPv6Address(f'::ffff:{modem.public_ip}').packed
+            assert bytes(modem.ipv4_packed) == ipaddress.IPv6Address(f'::ffff:{modem.ipv4}').packed
+            assert bytes(modem.ipv6_packed) == ipaddress.IPv6Address(modem.ipv6).packed
+
+    assert_in_sync()
+    Modem.objects.first().reboot_modem()
+    assert_in_sync()
+    Modem.reboot_many(Modem.objects.values_list('id', flat=True))
+    assert_in_sync()
+    Modem.rotate_all()
+    assert_in_sync()
+
+
+def test_packed_range():
+    assert packed_range('10.20.0.0/16') == (pack_address('10.20.0.0'), pack_address('10.20.255.255'))
+    assert packed_range('10.20.30.40/16')[0] == pack_address('10.20.0.0')
+    low, high = packed_range('2001:db8::/32')
+    assert low == ipaddress.ip_address('2001:db8::').packed
+    assert high == ipaddress.ip_address('2001:db8:ffff:ffff:ffff:ffff:ffff:ffff').packed
+    with pytest.raises(ValueError):
+        packed_range('10.20.0.0/33')
+
+
+@pytest.mark.django_db
+def test_modem_search_by_cidr(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-search')
+    response = api_client.get(url, {'cidr': '192.168.1.0/30'})
+    assert response.status_code == status.HTTP_200_OK
+    assert [row['public_ip'] for row in response.data['results']] == ['192.168.1.1', '192.168.1.2', '192.168.1.3']
+
+    response = api_client.get(url, {'cidr': '192.168.1.2/32', 'field': 'ipv4'})
+    assert [row['ipv4'] for row in response.data['results']] == ['192.168.1.2']
+
+    response = api_client.get(url, {'cidr': '2001:db8:85a3::8a2e:370:7335/128', 'field': 'ipv6'})
+    assert response.data['count'] == 1
+
+    assert api_client.get(url, {'cidr': '10.0.0.0/8'}).data['count'] == 0
+    assert api_client.get(url, {'cidr': 'nonsense'}).status_code == status.HTTP_400_BAD_REQUEST
+    assert api_client.get(url).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_modem_search_refused_in_critical_mode(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+
+    response = api_client.get(reverse('modem-search'), {'cidr': '192.168.1.2/32'})
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert 'results' not in response.data
+
+
+@pytest.mark.django_db
+def test_modem_list_and_search_cache_separately(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    params = {'cidr': '192.168.1.2/32'}
+
+    assert api_client.get(reverse('modem-list'), params).data['count'] == 3
+
+    response = api_client.get(reverse('modem-search'), params)
+    assert response['X-Cache'] == 'MISS'
+    assert response.data['count'] == 1
+    assert api_client.get(reverse('modem-search'), {'cidr': 'nonsense'}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Query plan assertions target SQLite')
+def test_modem_search_uses_index_range_scan():
+    plan = Modem.objects.filter(public_ip_packed__range=packed_range('10.20.0.0/16')).explain()
+    assert 'public_ip_packed' in plan and 'SEARCH' in plan
+
+
+@pytest.mark.django_db
+def test_cached_token_authentication(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    api_client.get(url)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert not [q for q in context.captured_queries if 'authtoken_token' in q['sql']]
+
+    metrics = api_client.get(reverse('metrics')).data['token_auth_cache']
+    assert metrics['hits'] == 2
+    assert metrics['misses'] == 1
+
+
+@pytest.mark.django_db
+def test_cached_token_invalidation(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('modem-list')
+    token = Token.objects.get(key=logged_in_user_token)
+    assert api_client.get(url).status_code == status.HTTP_200_OK
+
+    # Deactivating the user revokes the cached token
+    token.user.is_active = False
+    token.user.save()
+    assert api_client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+
+    token.user.is_active = True
+    token.user.save()
+    assert api_client.get(url).status_code == status.HTTP_200_OK
+
+    # Logging out deletes the token
+    api_client.post(reverse('rest_logout'))
+    assert api_client.get(url).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_event_broker_fans_out_by_modem():
+    async def scenario():
+        broker = InProcessBroker()
+        first = broker.subscribe({1})
+        everything = broker.subscribe()
+        broker.publish([{'type': 'modem.rotated', 'modem': 1}, {'type': 'modem.rotated', 'modem': 2}])
+        # Deliveries are scheduled on the subscribers' loop
+        await asyncio.sleep(0)
+
+        assert [event['modem'] for event in (first.queue.get_nowait(),)] == [1]
+        assert first.queue.empty()
+        assert [everything.queue.get_nowait()['modem'] for _ in range(2)] == [1, 2]
+
+        first.close()
+        everything.close()
+        assert not broker.has_subscribers()
+
+    asyncio.run(scenario())
+
+
+# The listener is stopped with SystemExit once the scenario is over
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_redis_broker_reconnects():
+    from redis import ConnectionError
+
+    class PubSub:
+        def __init__(self, messages):
+            self.messages = messages
+
+        def subscribe(self, channel):
+            pass
+
+        def listen(self):
+            for message in self.messages:
+                if isinstance(message, BaseException):
+                    raise message
+                yield message
+
+        def close(self):
+            pass
+
+    class Client:
+        # The first connection drops, the second one relays a batch of events
+        connections = iter([
+            [ConnectionError('Connection reset by peer')],
+            [{'type': 'message', 'data': json.dumps([{'type': 'modem.rotated', 'modem': 1}])}, SystemExit()],
+        ])
+
+        def pubsub(self, **kwargs):
+            return PubSub(next(self.connections))
+
+    async def scenario():
+        broker = RedisBroker('redis://localhost:6379', 'events')
+        broker.client = Client()
+        broker.retry_delay = 0
+        subscription = broker.subscribe()
+        listener = broker.listener
+        event = await asyncio.wait_for(subscription.get(), 5)
+        listener.join(5)
+        return broker, event
+
+    broker, event = asyncio.run(scenario())
+
+    assert event == {'type': 'modem.rotated', 'modem': 1}
+    # A listener that stopped is cleared so the next subscription starts a new one
+    assert broker.listener is None
+
+
+@pytest.mark.django_db
+def test_rotations_publish_events(modem, published_events, django_capture_on_commit_callbacks):
+    modems = list(Modem.objects.all())
+
+    with django_capture_on_commit_callbacks(execute=True):
+        modems[0].reboot_modem()
+    assert published_events == [{
+        'type': 'modem.rotated', 'modem': modems[0].pk,
+        'public_ip': modems[0].public_ip, 'ipv4': modems[0].ipv4, 'ipv6': modems[0].ipv6,
+    }]
+
+    published_events.clear()
+    with django_capture_on_commit_callbacks(execute=True):
+        Modem.reboot_many([modems[1].pk, modems[2].pk])
+        Modem.rotate_all()
+    assert [event['modem'] for event in published_events[:2]] == [modems[1].pk, modems[2].pk]
+    assert {event['type'] for event in published_events} == {'modem.rotated'}
+
+    # Nothing is published before the transaction commits
+    published_events.clear()
+    with django_capture_on_commit_callbacks(execute=False):
+        modems[0].reboot_modem()
+    assert published_events == []
+
+
+def event_stream_scope(query_string, token=None):
+    headers = [(b'authorization', f'Token {token}'.encode())] if token else []
+    return {'type': 'http', 'method': 'GET', 'path': '/events/', 'query_string': query_string.encode(),
+            'headers': headers}
+
+
+# Streams release their database connections like Django's request cycle, which a test transaction cannot survive
+@pytest.mark.django_db(transaction=True)
+def test_event_stream(logged_in_user_token, modem):
+    first, second, _ = Modem.objects.all()
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+    application = EventStreamApplication(None, '/events/')
+
+    async def scenario():
+        received = asyncio.Queue()
+        sent = asyncio.Queue()
+        stream = asyncio.ensure_future(application(
+            event_stream_scope(f'modem={first.pk}', logged_in_user_token), received.get, sent.put,
+        ))
+        start = await asyncio.wait_for(sent.get(), 5)
+        assert start['status'] == 200
+        assert (b'content-type', b'text/event-stream') in start['headers']
+        assert (await sent.get())['body'] == b': connected\n\n'
+
+        get_broker().publish([
+            {'type': 'modem.rotated', 'modem': second.pk, 'public_ip': '1.1.1.1', 'ipv4': '1.1.1.2', 'ipv6': '2a00::1'},
+            {'type': 'modem.rotated', 'modem': first.pk, 'public_ip': '1.1.1.1', 'ipv4': '1.1.1.2', 'ipv6': '2a00::1'},
+        ])
+        chunk = (await asyncio.wait_for(sent.get(), 5))['body']
+
+        # A client disconnecting ends the stream and its subscription
+        await received.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(stream, 5)
+        return chunk
+
+    chunk = async_to_sync(scenario)().decode()
+
+    # Only the subscribed modem's event arrives, masked while critical mode is enabled
+    assert chunk.startswith('event: modem.rotated\ndata: ')
+    event = json.loads(chunk.split('data: ', 1)[1])
+    assert event['modem'] == first.pk
+    assert event['public_ip'] == '***.***.***.***'
+    assert not get_broker().has_subscribers()
+
+
+@pytest.mark.django_db
+def test_event_stream_critical_mode_flag_is_shared(monkeypatch, settings):
+    settings.FEATURE_SETTINGS_CACHE_TTL = 60
+    FeatureSettings.objects.create(critical_mode_enabled=True)
+    loads = []
+    load = FeatureSettings.load
+    monkeypatch.setattr(FeatureSettings, 'load', lambda: loads.append(1) or load())
+
+    async def flags():
+        return [await critical_mode.get() for _ in range(100)]
+
+    # Masking a burst of events reads the settings once, not once per event
+    assert async_to_sync(flags)() == [True] * 100
+    assert len(loads) == 1
+
+    # Streams pick a toggle up once the flag expires
+    FeatureSettings.load().set_critical_mode(False)
+    critical_mode.expires = 0.0
+    assert async_to_sync(critical_mode.get)() is False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_event_stream_rejected_requests(logged_in_user_token):
+    application = EventStreamApplication(None, '/events/')
+
+    async def status_of(scope):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await application(scope, None, send)
+        return sent[0]['status']
+
+    assert async_to_sync(status_of)(event_stream_scope('modem=one', logged_in_user_token)) == 400
+    assert async_to_sync(status_of)(event_stream_scope('')) == 401
+    assert not get_broker().has_subscribers()
+
+
+def test_event_stream_application_routes_other_requests():
+    calls = []
+
+    async def django_application(scope, receive, send):
+        calls.append(scope['path'])
+
+    application = EventStreamApplication(django_application, '/events/')
+    async_to_sync(application)({'type': 'http', 'path': '/api/list_modems/'}, None, None)
+
+    assert calls == ['/api/list_modems/']
+
+
+@pytest.mark.django_db
+def test_staggered_rotation_schedules(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    before = timezone.now()
+
+    response = api_client.get(reverse('custom-rot'), {'index': 'all', 'min': 6, 'stagger': 'true'})
+
+    assert response.status_code == status.HTTP_200_OK
+    offsets = [schedule.next_due - before for schedule in RotationSchedule.objects.order_by('modem_id')]
+    # One modem every third of the interval, in id order
+    for offset, expected in zip(offsets, [timedelta(minutes=2), timedelta(minutes=4), timedelta(minutes=6)]):
+        assert expected <= offset < expected + timedelta(seconds=5)
+
+
+@pytest.mark.django_db
+def test_rotation_schedule_jitter(modem):
+    modem_ids = list(Modem.objects.values_list('id', flat=True))
+    before = timezone.now()
+
+    RotationSchedule.schedule_many(modem_ids, timedelta(minutes=5), jitter=timedelta(seconds=30))
+
+    for schedule in RotationSchedule.objects.all():
+        assert timedelta(minutes=5) <= schedule.next_due - before < timedelta(minutes=5, seconds=35)
+
+
+@pytest.mark.django_db
+def test_rotate_due_modems_max_rotations(modem):
+    now = timezone.now()
+    for position, modem_id in enumerate(Modem.objects.values_list('id', flat=True)):
+        RotationSchedule.objects.create(modem_id=modem_id, interval=timedelta(minutes=5),
+                                        next_due=now - timedelta(seconds=position + 1))
+
+    stats = rotate_due_modems(batch_size=1, max_rotations=2)
+
+    assert stats['rotated'] == 2
+    assert stats['remaining'] == 1
+    # The most overdue schedules go first; the rest is left for the next run
+    assert list(RotationSchedule.objects.filter(next_due__lte=now).values_list('modem_id', flat=True)) == [
+        Modem.objects.first().pk
+    ]
+    assert rotate_due_modems(max_rotations=2)['rotated'] == 1
+
+
+@pytest.mark.django_db
+def test_requested_rotations_coalesce(modem, django_capture_on_commit_callbacks, monkeypatch):
+    modems = list(Modem.objects.all())
+    flushes = []
+    monkeypatch.setattr(flush_rotations, 'delay', lambda: flushes.append(flush_rotations()))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        request_rotations([modems[0].pk, modems[1].pk])
+        request_rotations([modems[0].pk])
+    assert PendingRotation.objects.count() == 0
+
+    # The first flush rotates both modems once in a single bulk reboot; the duplicate finds nothing left
+    assert flushes == [{'rotated': 2}, {'rotated': 0}]
+    assert IPAssignment.objects.filter(modem=modems[0], kind=0).count() == 2
+    assert Modem.objects.get(pk=modems[2].pk).public_ip == modems[2].public_ip
+
+
+@pytest.mark.django_db
+def test_flush_rotations_batches(modem):
+    PendingRotation.add(Modem.objects.values_list('id', flat=True))
+
+    with CaptureQueriesContext(connection) as queries:
+        assert flush_rotations(batch_size=2) == {'rotated': 3}
+
+    assert not PendingRotation.objects.exists()
+    # Two batches claimed, then the empty claim ending the flush
+    assert sum(query['sql'].startswith('DELETE') for query in queries.captured_queries) == 2
+    assert sum('pendingrotation' in query['sql'] for query in queries.captured_queries) == 5
+
+
+@pytest.mark.django_db
+def test_duplicate_rotate_ip_messages_coalesce(modem, django_capture_on_commit_callbacks, monkeypatch):
+    first = Modem.objects.first()
+    flushes = []
+    monkeypatch.setattr(flush_rotations, 'delay', lambda: flushes.append('flush'))
+
+    # A backlog of messages for one modem queues one rotation and one flush
+    with django_capture_on_commit_callbacks(execute=True):
+        results = [rotate_ip(first.pk) for _ in range(5)]
+
+    assert results == [{'queued': True}] + [{'queued': False}] * 4
+    assert flushes == ['flush']
+    assert flush_rotations() == {'rotated': 1}
+    assert rotate_ip(999) == {'queued': False}
+
+
+@pytest.mark.django_db
+def test_bulk_reboot_queued(api_client, logged_in_user_token, modem, django_capture_on_commit_callbacks,
+                            monkeypatch):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+    flushes = []
+    monkeypatch.setattr(flush_rotations, 'delay', lambda: flushes.append(flush_rotations()))
+    before = list(Modem.objects.values_list('public_ip', flat=True))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.post(reverse('bulk-reboot-modems'), {'carrier': 'AT&T', 'queue': True}, format='json')
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data['queued'] == 1
+    assert flushes == [{'rotated': 1}]
+    assert list(Modem.objects.values_list('public_ip', flat=True))[1:] == before[1:]
+
+
+@pytest.mark.django_db
+def test_rotate_all_in_chunks(modem, monkeypatch):
+    monkeypatch.setattr('modems.models.shuffle', list.reverse)
+    monkeypatch.setattr('modems.models.randint', lambda low, high: high)
+    before = list(Modem.objects.values_list('public_ip', flat=True))
+
+    assert Modem.rotate_all(chunk_size=2)['rotated'] == 3
+
+    # Addresses are shuffled within each chunk, every chunk committed with its own history entries
+    assert list(Modem.objects.values_list('public_ip', flat=True)) == [before[1], before[0], before[2]]
+    rotations = IPAssignment.objects.filter(kind=0).order_by('id')[3:]
+    assert len({assignment.assigned_at for assignment in rotations}) == 1
+
+
+@pytest.mark.django_db
+def test_rotate_all_moves_chunk_boundaries(modem, monkeypatch):
+    monkeypatch.setattr('modems.models.shuffle', list.reverse)
+    first, second, third = Modem.objects.all()
+
+    # A first chunk of one modem shifts the bands of two to (first) and (second, third)
+    monkeypatch.setattr('modems.models.randint', lambda low, high: low)
+    Modem.rotate_all(chunk_size=2)
+
+    # The second modem's address left the (first, second) band of aligned chunks
+    assert Modem.objects.get(pk=third.pk).public_ip == second.public_ip
+    assert Modem.objects.get(pk=first.pk).public_ip == first.public_ip
+
+
+@pytest.mark.django_db
+def test_reboot_modem_keeps_concurrent_changes(modem):
+    instance = Modem.objects.first()
+    Modem.objects.filter(pk=instance.pk).update(carrier='Verizon')
+
+    instance.reboot_modem()
+
+    rebooted = Modem.objects.get(pk=instance.pk)
+    assert rebooted.carrier == 'Verizon'
+    assert (rebooted.public_ip, rebooted.public_ip_packed) == (instance.public_ip, instance.public_ip_packed)
+    assert IPAssignment.objects.filter(modem=instance, ip=instance.ipv6).exists()
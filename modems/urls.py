@@ -1,13 +1,21 @@
 from django.urls import path
 
+from modems import async_views
 from modems.views import ModemListView, FeatureSettingsUpdateView, RotateAllModemsView, RotateSpecificModemView, \
-    CustomRotView, ClearTaskInterval
+    BulkRebootView, CustomRotView, ClearTaskInterval, MetricsView, IPHistoryView, ModemSearchView
 
 urlpatterns = [
     path('list_modems/', ModemListView.as_view(), name='modem-list'),
+    path('search_modems/', ModemSearchView.as_view(), name='modem-search'),
     path('crit_mode/', FeatureSettingsUpdateView.as_view(), name='critical-mode-update'),
     path('rotate/', RotateAllModemsView.as_view(), name='rotate-all-modems'),
     path('reboot_modem/', RotateSpecificModemView.as_view(), name='reboot-modem'),
+    path('reboot_modems/', BulkRebootView.as_view(), name='bulk-reboot-modems'),
     path('custom_rot/', CustomRotView.as_view(), name='custom-rot'),
     path('clear_rot/', ClearTaskInterval.as_view(), name='clear-rot'),
+    path('ip_history/', IPHistoryView.as_view(), name='ip-history'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    # Native async variants, served without a thread per request under ASGI
+    path('async/list_modems/', async_views.list_modems, name='async-modem-list'),
+    path('async/reboot_modem/', async_views.reboot_modem, name='async-reboot-modem'),
 ]
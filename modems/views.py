@@ -1,14 +1,26 @@
-import json
+from datetime import timedelta
 
-from django_celery_beat.models import IntervalSchedule, PeriodicTask
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+from django_celery_beat.models import PeriodicTask
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.generics import ListAPIView, UpdateAPIView, get_object_or_404
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from modems import StandardResultsSetPagination
-from .models import Modem, FeatureSettings
-from .serializers import ModemSerializer, CriticalModemSerializer, FeatureSettingsSerializer, RotationParamsSerializer
+from core.authentication import token_cache
+from core.db import write_transaction
+from modems import StandardResultsSetPagination, ModemKeysetPagination
+from .cache import modem_list_cache
+from .fast import ValuesSerializer, fast_path_requested
+from .models import Modem, FeatureSettings, FleetVersion, IPAssignment, RotationSchedule
+from .serializers import ModemSerializer, CriticalModemSerializer, FeatureSettingsSerializer, RotationParamsSerializer, \
+    BulkRebootParamsSerializer, IPLookupParamsSerializer, IPAssignmentSerializer, CIDRSearchParamsSerializer, \
+    critical_mode_template, mask_modem
+from .tasks import request_rotations
+
+MODEM_VALUES = ValuesSerializer(ModemSerializer)
 
 
 class ModemListView(ListAPIView):
@@ -17,32 +29,101 @@ class ModemListView(ListAPIView):
 
     This view retrieves a list of Modems from the database and serializes them using either the standard
     serializer or the critical modem serializer based on the critical_mode_enabled flag from the FeatureSettings model.
-    If no FeatureSettings object exists, it creates one with critical_mode_enabled set to False.
+    The flag is read once per request from the cached FeatureSettings singleton, which is created with
+    critical_mode_enabled set to False if it does not exist.
+
+    Results are page-number paginated by default; passing 'pagination=cursor' switches to keyset pagination
+    on the modem id, and 'count=false' suppresses the total count in that mode.
+
+    Responses carry an ETag built from the fleet version counter and the critical mode flag. A request whose
+    If-None-Match header matches it is answered with 304 Not Modified without querying the Modem table.
+    Serialized pages are kept in the modem list cache under the same fleet version and critical mode flag.
+
+    Passing 'fast=true' reads the page with QuerySet.values() and skips the per-row serializers; the response
+    is the same.
     """
 
     queryset = Modem.objects.all()
     serializer_class = ModemSerializer
     pagination_class = StandardResultsSetPagination
+    critical_mode = False
+
+    def get_queryset(self):
+        # Masked listings only need the primary keys
+        if self.critical_mode:
+            return Modem.objects.values('id')
+        return super().get_queryset()
 
     def get_serializer_class(self):
-        # Check if critical mode is enabled in FeatureSettings and use the appropriate serializer
-        if FeatureSettings.objects.exists() and FeatureSettings.objects.first().critical_mode_enabled:
+        # Use the critical modem serializer when critical mode is enabled in FeatureSettings
+        if self.critical_mode:
             return CriticalModemSerializer
         return super().get_serializer_class()
 
-    def get_feature_settings(self):
-        # Retrieve FeatureSettings object if it exists, or create a new one with critical_mode_enabled set to False
-        if FeatureSettings.objects.exists():
-            return FeatureSettings.objects.first()
+    def list(self, request, *args, **kwargs):
+        # Read the critical mode flag once for the whole request
+        self.critical_mode = FeatureSettings.load().critical_mode_enabled
+
+        # Read the version before the listing so a concurrent write can only make the ETag older, never newer
+        fleet_version = FleetVersion.current()
+        etag = quote_etag(f'{fleet_version}-{int(self.critical_mode)}')
+
+        # Answer conditional requests for an unchanged fleet without listing it
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or f'W/{etag}' in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        # Serve the page from the cache when it was already serialized for this fleet version
+        cache_key = modem_list_cache.make_key(request, fleet_version, self.critical_mode)
+        data = modem_list_cache.get(cache_key)
+        if data is not None:
+            return Response(data, headers={'ETag': etag, 'X-Cache': 'HIT'})
+
+        # Switch to keyset pagination when requested by the client
+        if request.query_params.get('pagination') == 'cursor':
+            self.pagination_class = ModemKeysetPagination
+        if fast_path_requested(request):
+            response = self.fast_list(request)
         else:
-            return FeatureSettings.objects.create(critical_mode_enabled=False)
+            response = super().list(request, *args, **kwargs)
+        modem_list_cache.set(cache_key, response.data)
+        response['ETag'] = etag
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+    def fast_list(self, request):
+        # Paginate plain rows and convert them with the field map precompiled from ModemSerializer
+        if self.critical_mode:
+            template = critical_mode_template()
+            rows = [mask_modem(row['id'], template) for row in self.paginate_queryset(self.get_queryset())]
+        else:
+            queryset = self.filter_queryset(self.get_queryset()).values(*MODEM_VALUES.fields)
+            rows = MODEM_VALUES.serialize(self.paginate_queryset(queryset))
+        return self.get_paginated_response(rows)
+
+
+class ModemSearchView(ModemListView):
+    """
+    View for listing the Modems whose address falls in a CIDR block.
+
+    This view expects a 'cidr' query parameter (e.g. '10.20.0.0/16' or '2001:db8::/32') and an optional 'field'
+    among public_ip, ipv4 and ipv6 (public_ip by default). The block is turned into a range of packed addresses
+    answered by an index range scan. Pagination, ETags and caching work like ModemListView. The search is refused
+    while critical mode is enabled, as matching addresses would reveal which modem holds them.
+    """
 
     def list(self, request, *args, **kwargs):
-        # Get the FeatureSettings object and list of Modems
-        feature_settings = self.get_feature_settings()
-        response = super().list(request, *args, **kwargs)
+        if FeatureSettings.load().critical_mode_enabled:
+            raise PermissionDenied('Searching modems by address is disabled while critical mode is enabled.')
+        return super().list(request, *args, **kwargs)
 
-        return Response(response.data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        # Deserialize and validate the search parameters
+        serializer = CIDRSearchParamsSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        field = serializer.validated_data['field']
+        return super().get_queryset().filter(**{f'{field}_packed__range': serializer.validated_data['cidr']})
 
 
 class FeatureSettingsUpdateView(UpdateAPIView):
@@ -55,8 +136,9 @@ class FeatureSettingsUpdateView(UpdateAPIView):
     serializer_class = FeatureSettingsSerializer
 
     def get_object(self, queryset=None):
-        # Get the first FeatureSettings object from the database
-        return FeatureSettings.objects.first()
+        # Get the FeatureSettings singleton, bypassing the process-local cache
+        FeatureSettings.invalidate_cache()
+        return FeatureSettings.load()
 
     def update(self, request, *args, **kwargs):
         # Get the 'toggle' query parameter from the request
@@ -69,14 +151,8 @@ class FeatureSettingsUpdateView(UpdateAPIView):
         # Get the FeatureSettings object
         instance = self.get_object()
 
-        # Update the critical_mode_enabled field based on the 'toggle' parameter
-        if toggle == 'enable':
-            instance.critical_mode_enabled = True
-        else:
-            instance.critical_mode_enabled = False
-
-        # Save the updated FeatureSettings object
-        instance.save()
+        # Update the critical_mode_enabled field based on the 'toggle' parameter and bump the settings version
+        instance.set_critical_mode(toggle == 'enable')
 
         # Serialize the updated object and return it with a 200 OK status
         serializer = self.get_serializer(instance)
@@ -87,13 +163,14 @@ class RotateAllModemsView(APIView):
     """
     View for rotating all modems.
 
-    This view triggers the rotation process for all modems in the database by calling the 'rotate_all()' method of the Modem model.
+    This view triggers the rotation process for all modems in the database by calling the 'rotate_all()' method of the Modem model
+    and returns the rotation stats (number of rotated modems and elapsed time).
     """
 
     def get(self, request):
         # Trigger the 'rotate_all()' method of the Modem model
-        Modem.rotate_all()
-        return Response({"message": "All modems rotated successfully."})
+        stats = Modem.rotate_all()
+        return Response({"message": "All modems rotated successfully.", **stats})
 
 
 class RotateSpecificModemView(APIView):
@@ -117,23 +194,76 @@ class RotateSpecificModemView(APIView):
         return Response({"message": f"Modem {modem_index} rotated successfully."})
 
 
+class BulkRebootView(APIView):
+    """
+    View for rebooting many modems in one request.
+
+    This view accepts a JSON body selecting modems by 'ids' (a list of modem ids), an inclusive 'start'/'end' id
+    range and/or 'carrier' and 'model' filters. Every matching modem gets fresh IPs through Modem.reboot_many(),
+    which writes them with a single bulk UPDATE, and the rebooted ids are returned. With 'queue': true the modems
+    are queued through request_rotations() instead, and rotated by a worker in bulk with any other pending modem.
+    """
+
+    def post(self, request):
+        # Deserialize and validate the selection parameters
+        serializer = BulkRebootParamsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Select and reboot (or queue) the matching modems atomically, holding the write lock first on SQLite
+        queue = serializer.validated_data['queue']
+        with write_transaction():
+            modem_ids = list(self._select_modems(serializer.validated_data).values_list('id', flat=True))
+            if queue:
+                request_rotations(modem_ids)
+            else:
+                Modem.reboot_many(modem_ids)
+
+        if not modem_ids:
+            return Response({"message": "No matching modems found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if queue:
+            return Response({
+                "message": f"{len(modem_ids)} modems queued for rotation.",
+                "queued": len(modem_ids),
+                "ids": modem_ids,
+            }, status=status.HTTP_202_ACCEPTED)
+
+        return Response({
+            "message": f"{len(modem_ids)} modems rotated successfully.",
+            "rebooted": len(modem_ids),
+            "ids": modem_ids,
+        })
+
+    def _select_modems(self, data):
+        # Combine the explicit ids, the id range and the carrier/model filters
+        queryset = Modem.objects.all()
+        if 'ids' in data:
+            queryset = queryset.filter(pk__in=data['ids'])
+        if 'start' in data:
+            queryset = queryset.filter(pk__range=(data['start'], data['end']))
+        filters = {field: data[field] for field in ('carrier', 'model') if field in data}
+        return queryset.filter(**filters)
+
+
 class CustomRotView(APIView):
     """
     View for custom IP rotation scheduling.
 
     This view handles GET requests to schedule custom IP rotation tasks for modems. It receives the 'index' query parameter
-    to identify the modem and the 'day', 'hour', and 'min' query parameters to specify the rotation interval.
+    to identify the modem(s) ('all', a modem id or a comma-separated list of ids), optional 'carrier' and 'model'
+    filters, and the 'day', 'hour', and 'min' query parameters to specify the rotation interval. With 'stagger=true'
+    the first rotations are spread evenly across the interval and 'jitter' delays each by up to that many seconds,
+    so the modems do not all rotate in the same scanner run.
+    Schedules are upserted in bulk as RotationSchedule rows and executed by the periodic 'rotate_due_modems' scanner task.
     """
     def get(self, request):
         # Deserialize and validate the 'index', 'day', 'hour', and 'min' query parameters
         serializer = RotationParamsSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
 
-        # Get the 'index' query parameter from the request
-        dongle_index = request.query_params.get('index')
-
         # Get the validated rotation interval data from the serializer
         interval_data = serializer.validated_data
+        dongle_index = interval_data['index']
         day = interval_data.get('day', 0)
         hour = interval_data.get('hour', 0)
         minutes = interval_data.get('min', 0)
@@ -144,44 +274,76 @@ class CustomRotView(APIView):
 
         # Calculate the total rotation interval in minutes
         interval_in_minutes = day * 24 * 60 + hour * 60 + minutes
+        interval = timedelta(minutes=interval_in_minutes)
+
+        # Optional carrier/model filters narrow down the selected modems
+        filters = {field: interval_data[field] for field in ('carrier', 'model') if field in interval_data}
 
-        if dongle_index.lower() == 'all':
-            # Assign the IP rotation task to all modems
-            modems = Modem.objects.all()
-            for modem in modems:
-                self._create_or_update_task(modem, interval_in_minutes)
+        # Options spreading the rotations over time
+        spread = {'stagger': interval_data['stagger']}
+        if interval_data.get('jitter'):
+            spread['jitter'] = timedelta(seconds=interval_data['jitter'])
+
+        if dongle_index == 'all':
+            # Assign the IP rotation schedule to all (matching) modems
+            modem_ids = Modem.objects.filter(**filters).values_list('id', flat=True)
+            scheduled = RotationSchedule.schedule_many(modem_ids, interval, **spread)
             message = f"IP Rotation scheduled every {interval_in_minutes} minutes for all modems"
+        elif len(dongle_index) == 1 and not filters:
+            # Assign the IP rotation schedule to the specified modem
+            modem = get_object_or_404(Modem, pk=dongle_index[0])
+            scheduled = RotationSchedule.schedule_many([modem.pk], interval, **spread)
+            message = f"IP Rotation scheduled every {interval_in_minutes} minutes for Modem {modem.pk}"
         else:
-            # Assign the IP rotation task to the specified modem
-            modem = get_object_or_404(Modem, pk=dongle_index)
-            self._create_or_update_task(modem, interval_in_minutes)
-            message = f"IP Rotation scheduled every {interval_in_minutes} minutes for Modem {dongle_index}"
-
-        response_data = {"message": message}
+            # Assign the IP rotation schedule to every listed modem that exists (and matches the filters)
+            modem_ids = list(Modem.objects.filter(pk__in=dongle_index, **filters).values_list('id', flat=True))
+            if not modem_ids:
+                return Response({"message": "No matching modems found"}, status=status.HTTP_404_NOT_FOUND)
+            scheduled = RotationSchedule.schedule_many(modem_ids, interval, **spread)
+            message = f"IP Rotation scheduled every {interval_in_minutes} minutes for {scheduled} modems"
+
+        response_data = {"message": message, "scheduled": scheduled}
         return Response(response_data)
 
-    def _create_or_update_task(self, modem, interval_in_minutes):
-        # Create or update the IP rotation task for the modem
-        task_name = f'Rotating IP for Modem {modem.pk}'
-        schedule, created = IntervalSchedule.objects.get_or_create(
-            every=interval_in_minutes,
-            period=IntervalSchedule.MINUTES,
-        )
-
-        try:
-            existing_task = PeriodicTask.objects.get(name=task_name)
-            if existing_task.interval.every != interval_in_minutes:
-                existing_task.interval = schedule
-                existing_task.save()
-            return existing_task
-        except PeriodicTask.DoesNotExist:
-            task_args = json.dumps([modem.pk])
-            return PeriodicTask.objects.create(
-                interval=schedule,
-                name=task_name,
-                task='modems.tasks.rotate_ip',
-                args=task_args,
-            )
+
+class IPHistoryView(APIView):
+    """
+    View resolving which modem held an IP address at a point in time.
+
+    This view expects an 'ip' query parameter and an optional ISO 8601 'at' datetime (now by default). The
+    assignment is found in the IPAssignment history with two indexed lookups, whatever the size of the history.
+    Lookups are refused while critical mode is enabled, which hides the addresses of the modems.
+    """
+
+    def get(self, request):
+        if FeatureSettings.load().critical_mode_enabled:
+            raise PermissionDenied('IP history lookups are disabled while critical mode is enabled.')
+
+        # Deserialize and validate the query parameters
+        serializer = IPLookupParamsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ip = serializer.validated_data['ip']
+        at = serializer.validated_data.get('at') or timezone.now()
+
+        assignment = IPAssignment.holder_at(ip, at)
+        if assignment is None:
+            return Response({"message": f"No modem held {ip} at {at.isoformat()}."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(IPAssignmentSerializer(assignment).data)
+
+
+class MetricsView(APIView):
+    """
+    View exposing the process-local instrumentation counters: the modem list cache and the token authentication
+    cache hits and misses.
+    """
+
+    def get(self, request):
+        return Response({
+            'modem_list_cache': modem_list_cache.stats(),
+            'token_auth_cache': token_cache.stats(),
+        })
+
 
 class ClearTaskInterval(APIView):
     """
@@ -189,7 +351,7 @@ class ClearTaskInterval(APIView):
     """
 
     def get(self, request):
-        # Clear all IP rotation task intervals
-        PeriodicTask.objects.all().delete()
-        IntervalSchedule.objects.all().delete()
+        # Clear all IP rotation schedules, including per-modem beat entries created by older versions
+        RotationSchedule.objects.all().delete()
+        PeriodicTask.objects.filter(task='modems.tasks.rotate_ip').delete()
         return Response({"message": "IP rotation intervals cleared successfully."})
\ No newline at end of file
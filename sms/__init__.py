@@ -0,0 +1,6 @@
+from modems import KeysetPagination
+
+
+class SMSKeysetPagination(KeysetPagination):
+    page_size = 100
+    ordering = ('timestamp', 'id')
@@ -0,0 +1,75 @@
+from django.http import JsonResponse
+from rest_framework.exceptions import NotFound
+
+from modems.async_views import token_required
+from modems.fast import format_datetime
+from modems.models import Modem
+from sms import SMSKeysetPagination
+from sms.models import SMS
+from sms.views import ordered_sms, parse_limit
+
+SMS_FIELDS = ('id', 'date', 'phone_number', 'content', 'timestamp')
+
+
+@token_required
+async def list_sms(request):
+    """
+    Async variant of SMSListView.
+    """
+    index = request.GET.get('index')
+    queryset = SMS.objects.all()
+    if index:
+        try:
+            index = int(index)
+        except ValueError:
+            return JsonResponse({'message': 'Invalid index value. Please provide a valid integer.'}, status=400)
+        queryset = SMS.objects.filter(modem_id=index)
+
+    paginator = SMSKeysetPagination()
+    try:
+        rows = await paginator.apaginate_queryset(queryset.values(*SMS_FIELDS), request)
+    except NotFound as exc:
+        return JsonResponse({'detail': str(exc.detail)}, status=404)
+
+    # Only look the modem up when the indexed query came back empty on the first page
+    if not rows and index and not request.GET.get('cursor'):
+        if not await Modem.objects.filter(id=index).aexists():
+            return JsonResponse({'message': 'Modem with the provided index does not exist.'}, status=404)
+
+    for row in rows:
+        row['date'] = format_datetime(row['date'])
+    return JsonResponse(paginator.get_paginated_data(rows))
+
+
+@token_required
+async def list_sms_by_phone_number(request):
+    """
+    Async variant of SMSByPhoneNumberAPIView, also issuing two queries whatever the number of matching modems.
+    """
+    phone_number = request.GET.get('phone_number')
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+    except ValueError:
+        return JsonResponse({'message': 'Invalid limit value. Please provide a positive integer.'}, status=400)
+
+    modems = [modem async for modem in Modem.objects.filter(phone_number=phone_number).values('phone_number', 'id')]
+    if not phone_number or not modems:
+        # If no modems are found for the provided phone number, return a 404 NOT FOUND response.
+        return JsonResponse({"message": "Phone number not found"}, status=404)
+
+    messages = {modem['id']: [] for modem in modems}
+    async for row in ordered_sms(limit).filter(modem_id__in=list(messages)).values('modem_id', *SMS_FIELDS):
+        modem_id = row.pop('modem_id')
+        row['date'] = format_datetime(row['date'])
+        messages[modem_id].append(row)
+
+    data = [
+        {
+            'phone_number': modem['phone_number'],
+            'id': modem['id'],
+            'message': "SMS messages fetched successfully.",
+            'sms_messages': messages[modem['id']],
+        }
+        for modem in modems
+    ]
+    return JsonResponse(data, safe=False)
@@ -0,0 +1,167 @@
+"""
+Bulk SMS ingestion.
+
+Records are dicts with the SMS fields ('date', 'phone_number', 'content' and an optional 'timestamp') and the owning
+modem, given either by id ('modem') or by phone number ('modem_phone_number'). Valid records are converted straight
+to database values and written with batched prepared INSERTs, one bounded transaction per chunk of records; invalid
+ones are reported and skipped.
+"""
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.events import publish_on_commit, wants_events
+from modems.models import Modem, bulk_insert
+from sms.models import SMS, sms_event
+
+# Reported rejections per ingestion; the remaining ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+PHONE_NUMBER_MAX_LENGTH = SMS._meta.get_field('phone_number').max_length
+
+# Columns of the rows built by build_row()
+SMS_COLUMNS = ('modem', 'date', 'phone_number', 'content', 'timestamp')
+
+
+class IngestError(ValueError):
+    pass
+
+
+class ModemResolver:
+    """
+    Resolve the modem of SMS records by id or by phone number.
+
+    Lookups are cached for the lifetime of the resolver and the unknown keys of a whole chunk are fetched with one
+    query per key type. A phone number shared by several modems is ambiguous and cannot be resolved.
+    """
+
+    def __init__(self):
+        self.modem_ids = {}
+        self.phone_numbers = {}
+
+    def prefetch(self, records):
+        ids = set()
+        phone_numbers = set()
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            modem = record.get('modem')
+            if isinstance(modem, int) and modem not in self.modem_ids:
+                ids.add(modem)
+            phone_number = record.get('modem_phone_number')
+            if isinstance(phone_number, str) and phone_number not in self.phone_numbers:
+                phone_numbers.add(phone_number)
+
+        if ids:
+            found = set(Modem.objects.filter(id__in=ids).values_list('id', flat=True))
+            self.modem_ids.update((modem_id, modem_id in found) for modem_id in ids)
+        if phone_numbers:
+            self.phone_numbers.update(dict.fromkeys(phone_numbers))
+            for phone_number, modem_id in Modem.objects.filter(phone_number__in=phone_numbers).values_list(
+                    'phone_number', 'id'):
+                # Keep every candidate so shared numbers are detected
+                self.phone_numbers[phone_number] = (self.phone_numbers[phone_number] or ()) + (modem_id,)
+
+    def resolve(self, record):
+        if 'modem' in record:
+            modem = record['modem']
+            if not isinstance(modem, int) or isinstance(modem, bool):
+                raise IngestError("'modem' must be a modem id.")
+            if not self.modem_ids.get(modem):
+                raise IngestError(f'Modem {modem} does not exist.')
+            return modem
+
+        phone_number = record.get('modem_phone_number')
+        if phone_number is None:
+            raise IngestError("Please provide 'modem' or 'modem_phone_number'.")
+        candidates = self.phone_numbers.get(phone_number)
+        if not candidates:
+            raise IngestError(f'No modem with phone number {phone_number}.')
+        if len(candidates) > 1:
+            raise IngestError(f'Phone number {phone_number} is shared by several modems; use \'modem\' instead.')
+        return candidates[0]
+
+
+def parse_date(value):
+    if not isinstance(value, str):
+        raise IngestError("'date' must be an ISO 8601 datetime.")
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        date = parse_datetime(value)
+        if date is None:
+            raise IngestError("'date' must be an ISO 8601 datetime.")
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def build_row(record, resolver):
+    """
+    Validate one record and return its SMS_COLUMNS values in database format; raises IngestError when invalid.
+    """
+    if not isinstance(record, dict):
+        raise IngestError('Every record must be a JSON object.')
+
+    modem_id = resolver.resolve(record)
+    date = parse_date(record.get('date'))
+
+    phone_number = record.get('phone_number')
+    if not isinstance(phone_number, str) or not phone_number or len(phone_number) > PHONE_NUMBER_MAX_LENGTH:
+        raise IngestError(f"'phone_number' must be a string of 1 to {PHONE_NUMBER_MAX_LENGTH} characters.")
+    content = record.get('content')
+    if not isinstance(content, str):
+        raise IngestError("'content' must be a string.")
+
+    timestamp = record.get('timestamp')
+    if timestamp is None:
+        timestamp = date.timestamp()
+    elif not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+        raise IngestError("'timestamp' must be a number.")
+
+    return modem_id, connection.ops.adapt_datetimefield_value(date), phone_number, content, float(timestamp)
+
+
+def ingest_sms(records, batch_size=None, transaction_size=None, resolver=None):
+    """
+    Write an iterable of SMS records and return a summary of the ingestion.
+
+    Records are consumed in chunks of `transaction_size`; every chunk is committed in its own transaction with
+    INSERT batches of `batch_size` rows, so memory use and lock times stay bounded for any input size.
+    """
+    batch_size = batch_size or settings.SMS_INGEST_BATCH_SIZE
+    transaction_size = transaction_size or settings.SMS_INGEST_TRANSACTION_SIZE
+    resolver = resolver or ModemResolver()
+
+    result = {'received': 0, 'created': 0, 'rejected': 0, 'errors': []}
+    records = iter(records)
+    while chunk := list(islice(records, transaction_size)):
+        resolver.prefetch(chunk)
+
+        pending = []
+        events = [] if wants_events() else None
+        for position, record in enumerate(chunk, start=result['received']):
+            try:
+                row = build_row(record, resolver)
+                pending.append(row)
+                if events is not None:
+                    # Rows hold the database form of the date, so the event re-parses the record's one
+                    events.append(sms_event(row[0], parse_date(record['date']), *row[2:]))
+            except IngestError as exc:
+                result['rejected'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append({'record': position, 'error': str(exc)})
+        result['received'] += len(chunk)
+
+        with transaction.atomic():
+            for start in range(0, len(pending), batch_size):
+                bulk_insert(SMS, SMS_COLUMNS, pending[start:start + batch_size], prepare=False)
+            if events:
+                publish_on_commit(events)
+        result['created'] += len(pending)
+
+    return result
@@ -0,0 +1,54 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ParseError
+
+from sms.ingest import ingest_sms
+from sms.parsers import parse_json_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk ingest SMS messages from a JSON Lines file (one record per line) or a JSON array. "
+        "Records name their modem by 'modem' (id) or 'modem_phone_number'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to ingest, '-' for standard input")
+        parser.add_argument('--format', choices=['auto', 'jsonl', 'json'], default='auto',
+                            help="Input format; 'auto' picks 'json' for .json files and 'jsonl' otherwise")
+        parser.add_argument('--batch-size', type=int, help='Rows per bulk INSERT')
+        parser.add_argument('--transaction-size', type=int, help='Records committed per transaction')
+
+    def handle(self, *args, **options):
+        input_format = options['format']
+        if input_format == 'auto':
+            input_format = 'json' if options['path'].endswith('.json') else 'jsonl'
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            # JSON Lines are streamed; a JSON array has to be loaded as a whole
+            records = parse_json_lines(stream) if input_format == 'jsonl' else json.load(stream)
+            if isinstance(records, dict):
+                records = [records]
+            result = ingest_sms(records, options['batch_size'], options['transaction_size'])
+        except ParseError as exc:
+            # Chunks before the malformed line are already committed
+            raise CommandError(f'Invalid input: {exc.detail}')
+        except ValueError as exc:
+            raise CommandError(f'Invalid input: {exc}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - started
+
+        for error in result['errors']:
+            self.stderr.write(f"Record {error['record']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {result['created']} of {result['received']} SMS messages "
+            f"({result['rejected']} rejected) in {elapsed:.2f}s "
+            f"({result['created'] / elapsed if elapsed else 0:.0f} messages/s)."
+        ))
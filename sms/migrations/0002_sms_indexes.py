@@ -0,0 +1,29 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modems', '0009_modem_phone_number_index'),
+        ('sms', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sms',
+            name='modem',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='modem', to='modems.modem'),
+        ),
+        migrations.AlterField(
+            model_name='sms',
+            name='phone_number',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='sms',
+            index=models.Index(fields=['modem', 'timestamp'], name='sms_modem_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sms', '0002_sms_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sms',
+            index=models.Index(fields=['timestamp'], name='sms_timestamp_idx'),
+        ),
+    ]
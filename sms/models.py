@@ -1,12 +1,45 @@
-from django.db import models
+from django.db import models, transaction
 
+from core.events import publish_on_commit, wants_events
+from modems.fast import format_datetime
 from modems.models import Modem
 
 
+def sms_event(modem_id, date, phone_number, content, timestamp):
+    """
+    Return the 'sms.received' event of a message; `date` is an aware datetime.
+    """
+    return {
+        'type': 'sms.received',
+        'modem': modem_id,
+        'date': format_datetime(date),
+        'phone_number': phone_number,
+        'content': content,
+        'timestamp': timestamp,
+    }
+
+
 class SMS(models.Model):
 
-    modem = models.ForeignKey(Modem, on_delete=models.CASCADE, related_name='modem')
+    class Meta:
+        indexes = [
+            # Serves per-modem listings ordered by (timestamp, id); also covers plain modem_id lookups
+            models.Index(fields=['modem', 'timestamp'], name='sms_modem_timestamp_idx'),
+            # Serves the retention pruning, which deletes the oldest messages first
+            models.Index(fields=['timestamp'], name='sms_timestamp_idx'),
+        ]
+
+    modem = models.ForeignKey(Modem, on_delete=models.CASCADE, related_name='modem', db_index=False)
     date = models.DateTimeField()
-    phone_number = models.CharField(max_length=15)
+    phone_number = models.CharField(max_length=15, db_index=True)
     content = models.TextField()
     timestamp = models.FloatField()
+
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created and wants_events():
+                publish_on_commit([
+                    sms_event(self.modem_id, self.date, self.phone_number, self.content, self.timestamp),
+                ])
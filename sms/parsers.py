@@ -0,0 +1,32 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def parse_json_lines(lines):
+    """
+    Yield the JSON value of every non-blank line; raises ParseError naming the first malformed line.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error on line {line_number} - {exc}')
+
+
+class JSONLinesParser(BaseParser):
+    """
+    Parses JSON Lines (newline delimited JSON) request bodies into a list of values.
+    """
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return list(parse_json_lines(codecs.getreader(encoding)(stream)))
@@ -0,0 +1,76 @@
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import SMS
+
+
+def delete_in_chunks(queryset, chunk_size, pause):
+    """
+    Delete the rows of an ordered queryset `chunk_size` at a time and return the number of deleted rows.
+
+    Every chunk is a short DELETE by primary key in its own transaction, and the task sleeps `pause` seconds
+    between chunks so API reads and writes are never locked out for the length of the whole prune.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += SMS.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < chunk_size:
+            return deleted
+        time.sleep(pause)
+
+
+def prune_by_age(max_age, chunk_size, pause):
+    # Oldest messages first, served by the timestamp index
+    cutoff = (timezone.now() - max_age).timestamp()
+    return delete_in_chunks(SMS.objects.filter(timestamp__lt=cutoff).order_by('timestamp'), chunk_size, pause)
+
+
+def prune_by_count(max_per_modem, chunk_size, pause):
+    deleted = 0
+    modem_ids = (
+        SMS.objects.values('modem').annotate(messages=Count('id'))
+        .filter(messages__gt=max_per_modem).values_list('modem', flat=True)
+    )
+    for modem_id in list(modem_ids):
+        # The newest message beyond the limit; it and everything older than it goes, like the (timestamp, id) order
+        messages = SMS.objects.filter(modem_id=modem_id)
+        boundary = messages.order_by('-timestamp', '-id').values_list('timestamp', 'id')[max_per_modem:].first()
+        if boundary is None:
+            continue
+        timestamp, pk = boundary
+        expired = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=pk))
+        deleted += delete_in_chunks(expired.order_by('timestamp', 'id'), chunk_size, pause)
+    return deleted
+
+
+@shared_task
+def prune_sms(max_age_days=None, max_per_modem=None, chunk_size=None, pause=None):
+    """
+    Enforce the SMS retention policy: delete messages older than SMS_RETENTION_MAX_AGE_DAYS, then the oldest
+    messages of every modem holding more than SMS_RETENTION_MAX_PER_MODEM. A limit of 0 disables it.
+
+    Rows are deleted in chunks of SMS_PRUNE_CHUNK_SIZE with a pause of SMS_PRUNE_PAUSE seconds between chunks.
+    """
+    max_age_days = settings.SMS_RETENTION_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_per_modem = settings.SMS_RETENTION_MAX_PER_MODEM if max_per_modem is None else max_per_modem
+    chunk_size = chunk_size or settings.SMS_PRUNE_CHUNK_SIZE
+    pause = settings.SMS_PRUNE_PAUSE if pause is None else pause
+    started = time.perf_counter()
+
+    deleted_by_age = prune_by_age(timedelta(days=max_age_days), chunk_size, pause) if max_age_days else 0
+    deleted_by_count = prune_by_count(max_per_modem, chunk_size, pause) if max_per_modem else 0
+
+    return {
+        'deleted': deleted_by_age + deleted_by_count,
+        'deleted_by_age': deleted_by_age,
+        'deleted_by_count': deleted_by_count,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -1,8 +1,20 @@
+import io
+import json
+from datetime import timedelta
+
 import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
+from modems.models import Modem
+from sms import SMSKeysetPagination
+from sms.ingest import ingest_sms
 from sms.models import SMS
+from sms.tasks import prune_sms
 
 
 @pytest.mark.django_db
@@ -64,8 +76,8 @@ def test_sms_list_view_correct_index(api_client, logged_in_user_token, modem):
     response = api_client.get(url, {'index': modem.id})
 
     assert response.status_code == status.HTTP_200_OK
-    assert len(response.data) == 1
-    assert response.data[0]['phone_number'] == sms_data['phone_number']
+    assert len(response.data['results']) == 1
+    assert response.data['results'][0]['phone_number'] == sms_data['phone_number']
 
 
 @pytest.mark.django_db
@@ -89,7 +101,7 @@ def test_sms_list_view_no_index(api_client, logged_in_user_token, modem):
     response = api_client.get(url, {'index': modem.id})
 
     assert response.status_code == status.HTTP_200_OK
-    assert len(response.data) == num_sms_instances
+    assert len(response.data['results']) == num_sms_instances
 
 
 @pytest.mark.django_db
@@ -145,3 +157,313 @@ def test_sms_by_phone_view_single_result(api_client, logged_in_user_token, modem
 
     assert response.status_code == status.HTTP_200_OK
     assert len(response.data[0]['sms_messages']) == num_sms_instances
+
+
+@pytest.mark.django_db
+def test_sms_list_view_keyset_pagination(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    # Several messages share a timestamp so the id tie-breaker is exercised
+    for i in range(5):
+        SMS.objects.create(modem=modem, date='2023-08-06T12:00:00Z', phone_number='123456789',
+                           content=f'Message {i}', timestamp=1234567890.0 + i // 2)
+
+    url = reverse('sms-list-index')
+    response = api_client.get(url, {'page_size': 2})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['count'] == 5
+    contents = [sms['content'] for sms in response.data['results']]
+
+    while response.data['next']:
+        response = api_client.get(response.data['next'])
+        contents += [sms['content'] for sms in response.data['results']]
+
+    assert contents == [f'Message {i}' for i in range(5)]
+
+
+@pytest.mark.django_db
+def test_sms_list_view_count_suppressed(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('sms-list-index')
+    response = api_client.get(url, {'count': 'false'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert 'count' not in response.data
+
+
+@pytest.mark.django_db
+def test_sms_list_view_invalid_cursor(api_client, logged_in_user_token):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    url = reverse('sms-list-index')
+    response = api_client.get(url, {'cursor': 'not-a-cursor'})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Query plan assertions target SQLite')
+def test_sms_by_modem_query_uses_index():
+    plan = SMS.objects.filter(modem_id=1).order_by('timestamp', 'id').explain()
+
+    assert 'sms_modem_timestamp_idx' in plan
+    # The index already yields rows in (timestamp, id) order, no sort step is needed
+    assert 'TEMP B-TREE' not in plan
+
+
+def cursor_page_plan(queryset):
+    # Plan of a page that seeks past a cursor, as built by the paginator
+    paginator = SMSKeysetPagination()
+    paginator.page_size = 100
+    paginator.position = [1234567890.0, 5]
+    return paginator.get_page_queryset(queryset).explain()
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Query plan assertions target SQLite')
+def test_sms_cursor_page_seeks_timestamp_index():
+    plan = cursor_page_plan(SMS.objects.all())
+
+    # The cursor bounds the index range instead of scanning every row before it
+    assert 'SEARCH' in plan
+    assert 'sms_timestamp_idx (timestamp>?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Query plan assertions target SQLite')
+def test_sms_by_modem_cursor_page_seeks_index():
+    plan = cursor_page_plan(SMS.objects.filter(modem_id=1))
+
+    assert 'sms_modem_timestamp_idx (modem_id=? AND timestamp>?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason='Query plan assertions target SQLite')
+def test_phone_number_queries_use_index():
+    modem_plan = Modem.objects.filter(phone_number='123456789').explain()
+    sms_plan = SMS.objects.filter(phone_number='123456789').explain()
+
+    assert 'USING INDEX' in modem_plan
+    assert 'USING INDEX' in sms_plan
+
+
+@pytest.mark.django_db
+def test_sms_by_phone_view_query_count(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    # Several modems share the phone number, each with its own messages
+    modems = [modem] + [
+        Modem.objects.create(model='USB', carrier='AT&T', public_ip=f'10.0.0.{i}', ipv4=f'10.0.1.{i}',
+                             ipv6=f'2001:db8::{i:x}', phone_number=modem.phone_number)
+        for i in range(1, 6)
+    ]
+    for owner in modems:
+        for i in range(3):
+            SMS.objects.create(modem=owner, date='2023-08-06T12:00:00Z', phone_number='5550000',
+                               content=f'Message {i}', timestamp=1234567890.0 + i)
+
+    url = reverse('sms-list-number')
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url, {'phone_number': modem.phone_number})
+
+    data_queries = [q for q in context.captured_queries if 'authtoken_token' not in q['sql']]
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data) == len(modems)
+    assert len(data_queries) == 2
+    assert [sms['content'] for sms in response.data[0]['sms_messages']] == ['Message 0', 'Message 1', 'Message 2']
+
+
+@pytest.mark.django_db
+def test_sms_by_phone_view_limit(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    for i in range(4):
+        SMS.objects.create(modem=modem, date='2023-08-06T12:00:00Z', phone_number='5550000',
+                           content=f'Message {i}', timestamp=1234567890.0 + i)
+
+    url = reverse('sms-list-number')
+    response = api_client.get(url, {'phone_number': modem.phone_number, 'limit': 2})
+
+    assert response.status_code == status.HTTP_200_OK
+    # The most recent messages are kept, still in chronological order
+    assert [sms['content'] for sms in response.data[0]['sms_messages']] == ['Message 2', 'Message 3']
+
+    response = api_client.get(url, {'phone_number': modem.phone_number, 'limit': 0})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_async_sms_views_match_sync_views(api_client, logged_in_user_token, modem, async_get):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    for i in range(3):
+        SMS.objects.create(modem=modem, date='2023-08-06T12:00:00Z', phone_number='5550000',
+                           content=f'Message {i}', timestamp=1234567890.0 + i)
+
+    sync_response = api_client.get(reverse('sms-list-index'), {'index': modem.id})
+    async_response = async_get(reverse('async-sms-list-index'), {'index': modem.id},
+                               AUTHORIZATION='Token ' + logged_in_user_token)
+
+    assert async_response.status_code == status.HTTP_200_OK
+    assert async_response.json()['results'] == sync_response.json()['results']
+
+    sync_response = api_client.get(reverse('sms-list-number'), {'phone_number': modem.phone_number})
+    async_response = async_get(reverse('async-sms-list-number'),
+                               {'phone_number': modem.phone_number},
+                               AUTHORIZATION='Token ' + logged_in_user_token)
+
+    assert async_response.status_code == status.HTTP_200_OK
+    assert async_response.json() == sync_response.json()
+
+
+@pytest.mark.django_db
+def test_async_sms_list_nonexistent_modem(logged_in_user_token, async_get):
+    response = async_get(reverse('async-sms-list-index'), {'index': 999},
+                         AUTHORIZATION='Token ' + logged_in_user_token)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()['message'] == 'Modem with the provided index does not exist.'
+
+
+@pytest.mark.django_db
+def test_sms_list_view_fast_path_matches(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    SMS.objects.create(modem=modem, date='2023-08-06T12:00:00.123456Z', phone_number='123456789',
+                       content='Café   "quoted"', timestamp=1234567890.25)
+    SMS.objects.create(modem=modem, date='2023-08-06T13:00:00Z', phone_number='123456789',
+                       content='Second', timestamp=1234567891.0)
+
+    url = reverse('sms-list-index')
+    for params in ({'index': modem.id}, {'page_size': 1}):
+        regular = api_client.get(url, {**params, 'fast': 'false'})
+        fast = api_client.get(url, {**params, 'fast': 'true'})
+
+        assert fast.status_code == status.HTTP_200_OK
+        assert fast.content.replace(b'fast=true', b'fast=false') == regular.content
+
+
+@pytest.mark.django_db
+def test_sms_ingest_json_array(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    records = [
+        {'modem': modem.id, 'date': '2023-08-06T12:00:00Z', 'phone_number': '5551234', 'content': 'By id',
+         'timestamp': 1691323200.5},
+        {'modem_phone_number': modem.phone_number, 'date': '2023-08-06T13:00:00+00:00', 'phone_number': '5551234',
+         'content': 'By phone number'},
+        {'modem': 999, 'date': '2023-08-06T13:00:00Z', 'phone_number': '5551234', 'content': 'Unknown modem'},
+        {'modem': modem.id, 'date': 'yesterday', 'phone_number': '5551234', 'content': 'Invalid date'},
+    ]
+    response = api_client.post(reverse('sms-ingest'), records, format='json')
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data['created'] == 2
+    assert response.data['rejected'] == 2
+    assert [error['record'] for error in response.data['errors']] == [2, 3]
+
+    messages = list(SMS.objects.filter(modem=modem).order_by('timestamp'))
+    assert [sms.content for sms in messages] == ['By id', 'By phone number']
+    assert messages[1].timestamp == 1691326800.0
+    assert messages[1].date.isoformat() == '2023-08-06T13:00:00+00:00'
+
+
+@pytest.mark.django_db
+def test_sms_ingest_json_lines(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    body = '\n'.join(
+        json.dumps({'modem': modem.id, 'date': f'2023-08-06T12:00:0{i}Z', 'phone_number': '5551234',
+                    'content': f'Message {i}'})
+        for i in range(5)
+    ) + '\n'
+    response = api_client.post(reverse('sms-ingest'), body, content_type='application/x-ndjson')
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data['created'] == 5
+    assert SMS.objects.filter(modem=modem).count() == 5
+
+    response = api_client.post(reverse('sms-ingest'), '{"modem": 1}\n{oops', content_type='application/x-ndjson')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert SMS.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_sms_ingest_ambiguous_phone_number(api_client, logged_in_user_token, modem):
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + logged_in_user_token)
+
+    Modem.objects.create(model='USB', carrier='AT&T', public_ip='1.1.1.1', ipv4='1.1.1.2', ipv6='2001::1',
+                         phone_number=modem.phone_number)
+    record = {'modem_phone_number': modem.phone_number, 'date': '2023-08-06T12:00:00Z', 'phone_number': '5551234',
+              'content': 'Ambiguous'}
+    response = api_client.post(reverse('sms-ingest'), [record], format='json')
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert 'shared by several modems' in response.data['errors'][0]['error']
+
+
+@pytest.mark.django_db
+def test_ingest_sms_command_commits_bounded_transactions(modem, tmp_path):
+    path = tmp_path / 'sms.jsonl'
+    path.write_text(''.join(
+        json.dumps({'modem': modem.id, 'date': '2023-08-06T12:00:00Z', 'phone_number': '5551234',
+                    'content': f'Message {i}'}) + '\n'
+        for i in range(25)
+    ))
+
+    with CaptureQueriesContext(connection) as context:
+        call_command('ingest_sms', str(path), '--transaction-size', '10', '--batch-size', '4', stdout=io.StringIO())
+
+    assert SMS.objects.filter(modem=modem).count() == 25
+    # Only the first chunk looks the modem up; the resolver caches it for the following ones
+    assert len([q for q in context.captured_queries if 'modems_modem' in q['sql']]) == 1
+
+
+@pytest.mark.django_db
+def test_prune_sms_by_age(modem):
+    now = timezone.now()
+    for days in (1, 10, 40, 50, 60):
+        sent = now - timedelta(days=days)
+        SMS.objects.create(modem=modem, date=sent, phone_number='5551234', content=f'{days} days old',
+                           timestamp=sent.timestamp())
+
+    result = prune_sms(max_age_days=30, max_per_modem=0, chunk_size=2, pause=0)
+
+    assert result['deleted'] == result['deleted_by_age'] == 3
+    assert sorted(SMS.objects.values_list('content', flat=True)) == ['1 days old', '10 days old']
+
+
+@pytest.mark.django_db
+def test_prune_sms_by_count_keeps_newest(modem):
+    # Several messages share a timestamp so the id tie-breaker is exercised
+    for i in range(7):
+        SMS.objects.create(modem=modem, date='2023-08-06T12:00:00Z', phone_number='5551234',
+                           content=f'Message {i}', timestamp=1234567890.0 + i // 2)
+
+    result = prune_sms(max_age_days=0, max_per_modem=3, chunk_size=2, pause=0)
+
+    assert result['deleted_by_count'] == 4
+    assert list(SMS.objects.order_by('timestamp', 'id').values_list('content', flat=True)) == \
+        ['Message 4', 'Message 5', 'Message 6']
+    assert prune_sms(max_age_days=0, max_per_modem=3)['deleted'] == 0
+
+
+@pytest.mark.django_db
+def test_sms_inserts_publish_events(modem, published_events, django_capture_on_commit_callbacks):
+    records = [
+        {'modem': modem.id, 'date': '2023-08-06T12:00:00Z', 'phone_number': '5551234', 'content': 'Ingested'},
+    ]
+    with django_capture_on_commit_callbacks(execute=True):
+        ingest_sms(records)
+        SMS.objects.create(modem=modem, date=timezone.now(), phone_number='5550000', content='Saved', timestamp=1.0)
+
+    assert [(event['type'], event['modem'], event['content']) for event in published_events] == [
+        ('sms.received', modem.id, 'Ingested'),
+        ('sms.received', modem.id, 'Saved'),
+    ]
+    assert published_events[0]['date'] == '2023-08-06T12:00:00Z'
+    assert published_events[0]['timestamp'] == 1691323200.0
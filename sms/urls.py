@@ -1,8 +1,13 @@
 from django.urls import path
 
-from sms.views import SMSListView, SMSByPhoneNumberAPIView
+from sms import async_views
+from sms.views import SMSListView, SMSByPhoneNumberAPIView, SMSIngestView
 
 urlpatterns = [
     path('sms/get/', SMSListView.as_view(), name='sms-list-index'),
     path('sms/fetch_sms_phone_number/', SMSByPhoneNumberAPIView.as_view(), name='sms-list-number'),
+    path('sms/ingest/', SMSIngestView.as_view(), name='sms-ingest'),
+    # Native async variants, served without a thread per request under ASGI
+    path('async/sms/get/', async_views.list_sms, name='async-sms-list-index'),
+    path('async/sms/fetch_sms_phone_number/', async_views.list_sms_by_phone_number, name='async-sms-list-number'),
 ]
@@ -1,19 +1,56 @@
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from rest_framework import status
 from rest_framework.exceptions import ParseError, NotFound
 from rest_framework.generics import ListAPIView
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from modems.fast import ValuesSerializer, fast_path_requested
 from modems.models import Modem
+from sms import SMSKeysetPagination
+from sms.ingest import ingest_sms
+from sms.parsers import JSONLinesParser
 from sms.serializers import SMSSerializer, ByPhoneSerializer
 from sms.models import SMS
 
+SMS_VALUES = ValuesSerializer(SMSSerializer)
+
+
+def parse_limit(value):
+    # Per-modem message limit; None when not provided, ValueError unless a positive integer
+    if value is None:
+        return None
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError(value)
+    return limit
+
+
+def ordered_sms(limit=None):
+    """
+    Return SMS messages ordered by (timestamp, id), keeping only the `limit` most recent messages of each modem when
+    a limit is given.
+    """
+    sms_queryset = SMS.objects.order_by('timestamp', 'id')
+    if limit is None:
+        return sms_queryset
+
+    # Number the messages of each modem from the newest one and keep the first `limit`
+    return sms_queryset.annotate(
+        recency=Window(RowNumber(), partition_by=F('modem'), order_by=[F('timestamp').desc(), F('id').desc()]),
+    ).filter(recency__lte=limit)
+
 
 class SMSListView(ListAPIView):
     """
     A view to retrieve a list of SMS messages based on a provided modem index.
 
     This view allows fetching all SMS messages associated with a specific modem
-    or all SMS messages if no index is provided.
+    or all SMS messages if no index is provided. Results are keyset paginated on (timestamp, id);
+    follow the 'next' link to fetch the following page and pass 'count=false' to skip the total count.
+    Pass 'fast=true' to read the page with QuerySet.values() instead of serializing every message.
 
     Args:
         index (int, optional): The ID of the modem to filter SMS messages.
@@ -27,58 +64,116 @@ class SMSListView(ListAPIView):
         NotFound: If the modem with the provided index does not exist.
     """
     serializer_class = SMSSerializer
+    pagination_class = SMSKeysetPagination
 
     def get_queryset(self):
+        self.modem_index = None
         index = self.request.query_params.get('index')
         if index:
             try:
-                index = int(index)
-                modem = Modem.objects.get(id=index)
-                return SMS.objects.filter(modem=modem)
+                self.modem_index = int(index)
             except ValueError:
                 # If the provided index value is not a valid integer, raise a ParseError.
                 raise ParseError({'message': 'Invalid index value. Please provide a valid integer.'})
-            except Modem.DoesNotExist:
-                # If the modem with the provided index does not exist, raise a NotFound error.
-                raise NotFound({'message': 'Modem with the provided index does not exist.'})
+            # Filter on the foreign key column directly so the (modem, timestamp) index serves the query
+            return SMS.objects.filter(modem_id=self.modem_index)
 
         # If no index is provided, return all SMS messages from the database.
         return SMS.objects.all()
 
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # Only look the modem up when the indexed query came back empty on the first page
+        if not page and self.modem_index is not None and not self.request.query_params.get('cursor'):
+            if not Modem.objects.filter(id=self.modem_index).exists():
+                # If the modem with the provided index does not exist, raise a NotFound error.
+                raise NotFound({'message': 'Modem with the provided index does not exist.'})
+        return page
+
+    def list(self, request, *args, **kwargs):
+        if not fast_path_requested(request):
+            return super().list(request, *args, **kwargs)
+
+        # Paginate plain rows and convert them with the field map precompiled from SMSSerializer
+        queryset = self.filter_queryset(self.get_queryset()).values(*SMS_VALUES.fields)
+        return self.get_paginated_response(SMS_VALUES.serialize(self.paginate_queryset(queryset)))
+
 
 class SMSByPhoneNumberAPIView(ListAPIView):
     """
     A view to retrieve a list of modems based on a provided phone number.
 
-    This view allows fetching all modems associated with a specific phone number.
+    This view allows fetching all modems associated with a specific phone number together with their SMS messages,
+    ordered by (timestamp, id). The messages of all matching modems are prefetched with a single query, so the view
+    issues two queries no matter how many modems share the number.
 
     Args:
         phone_number (str, optional): The phone number to filter modems.
+        limit (int, optional): Only return the most recent `limit` messages of each modem.
 
     Returns:
         QuerySet: The queryset containing the modems based on the provided phone number.
 
     Raises:
-        None.
+        ParseError: If the provided limit value is not a positive integer.
     """
     serializer_class = ByPhoneSerializer
 
+    def get_sms_queryset(self):
+        try:
+            limit = parse_limit(self.request.query_params.get('limit'))
+        except ValueError:
+            raise ParseError({'message': 'Invalid limit value. Please provide a positive integer.'})
+        return ordered_sms(limit)
+
     def get_queryset(self):
         phone_number = self.request.query_params.get('phone_number')
 
         if phone_number:
-            return Modem.objects.filter(phone_number=phone_number)
+            return Modem.objects.filter(phone_number=phone_number).prefetch_related(
+                Prefetch('modem', queryset=self.get_sms_queryset())
+            )
 
         # If no 'phone_number' is provided, return an empty queryset.
         return Modem.objects.none()
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        # Evaluate the modems (and their prefetched messages) once
+        modems = list(self.get_queryset())
 
-        if not queryset.exists():
+        if not modems:
             # If no modems are found for the provided phone number, return a 404 NOT FOUND response.
             return Response(data={"message": "Phone number not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer(modems, many=True)
         # Return the serialized data in the response.
         return Response(serializer.data)
+
+
+class SMSIngestView(APIView):
+    """
+    A view to ingest SMS messages in bulk for many modems at once.
+
+    The body is a JSON array ('application/json') or JSON Lines ('application/x-ndjson') of records with the
+    'date', 'phone_number', 'content' and optional 'timestamp' of a message, and its modem given by id ('modem')
+    or by phone number ('modem_phone_number'). Valid records are written with batched bulk inserts in bounded
+    transactions; invalid ones are skipped and reported.
+
+    Returns:
+        Response: The number of received, created and rejected records, with the first rejection reasons.
+    """
+    parser_classes = [JSONParser, JSONLinesParser]
+
+    def post(self, request):
+        records = request.data
+        if isinstance(records, dict):
+            records = [records]
+        if not isinstance(records, list) or not records:
+            raise ParseError({'message': 'Please provide a JSON array or JSON Lines of SMS records.'})
+
+        result = ingest_sms(records)
+
+        if not result['created']:
+            # Nothing could be written: every record was rejected
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)